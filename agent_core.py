@@ -0,0 +1,446 @@
+"""
+智能体核心
+
+命令行的 MCPAgent 和HTTP服务的 StreamingChatAgent 共用这一个对话引擎：
+引擎负责构建消息、工具schema、参数校验、预取、工具调度和OpenAI流式调用，
+对外只产出类型化的事件，由各自的调用方决定如何展示或传输。
+"""
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, ClassVar
+
+from metrics import metrics
+from openai_schema_builder import SchemaBuilder
+from tool_args import ToolArgumentError, get_validator
+from tool_results import compact_dumps, compact_tool_result
+from tools.cache_backend import cache_get, cache_set
+from tools.city2code import canonical_city, extract_cities
+
+logger = logging.getLogger(__name__)
+
+MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+# 是否根据用户消息中的城市提前调用weather工具，与首次OpenAI调用并行
+SPECULATIVE_TOOLS = os.getenv("SPECULATIVE_TOOLS", "0") == "1"
+# 同一轮中最多同时执行的工具调用数量
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))
+# 是否精简交给模型的工具结果，见tool_results.py
+COMPACT_TOOL_RESULTS = os.getenv("COMPACT_TOOL_RESULTS", "1") == "1"
+
+
+# ---------------------------------------------------------------- 事件
+
+@dataclass
+class AgentEvent:
+    """引擎事件基类，to_dict 的输出就是 chat.js 解析的事件格式"""
+    type: ClassVar[str] = ""
+
+    def to_dict(self) -> dict:
+        return {"type": self.type, **vars(self)}
+
+
+@dataclass
+class StartEvent(AgentEvent):
+    type: ClassVar[str] = "start"
+    message: str = "开始处理您的问题..."
+
+
+@dataclass
+class ToolCallsEvent(AgentEvent):
+    type: ClassVar[str] = "tool_calls"
+    tools: list
+
+
+@dataclass
+class ToolExecutingEvent(AgentEvent):
+    type: ClassVar[str] = "tool_executing"
+    tool_name: str
+    message: str
+
+
+@dataclass
+class ToolResultEvent(AgentEvent):
+    type: ClassVar[str] = "tool_result"
+    tool_name: str
+    result: str
+
+
+@dataclass
+class ToolErrorEvent(AgentEvent):
+    type: ClassVar[str] = "tool_error"
+    tool_name: str
+    error: str
+
+
+@dataclass
+class GeneratingEvent(AgentEvent):
+    type: ClassVar[str] = "generating"
+    message: str = "正在生成回答..."
+
+
+@dataclass
+class ContentEvent(AgentEvent):
+    type: ClassVar[str] = "content"
+    content: str
+
+
+@dataclass
+class EndEvent(AgentEvent):
+    type: ClassVar[str] = "end"
+    message: str = "回答完成"
+
+
+@dataclass
+class ErrorEvent(AgentEvent):
+    type: ClassVar[str] = "error"
+    error: str
+
+
+# ---------------------------------------------------------------- 可替换组件
+
+class ToolScheduler:
+    """
+    工具调用调度器：同一轮的多个工具调用并发执行，最多max_concurrency个同时进行
+
+    Args:
+        max_concurrency: 最大并发数，1表示按顺序执行
+    """
+
+    def __init__(self, max_concurrency: int = TOOL_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+
+    async def run(self, jobs):
+        """执行一组协程，按输入顺序返回结果"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_one(job):
+            async with semaphore:
+                return await job
+
+        return await asyncio.gather(*(run_one(job) for job in jobs))
+
+
+# ---------------------------------------------------------------- 引擎
+
+class AgentEngine:
+    """
+    事件驱动的对话引擎
+
+    Args:
+        openai_client: AsyncOpenAI客户端
+        mcp_session: MCP会话，为None时以无工具模式运行
+        tool_cache: 工具结果缓存，需提供get(key)/set(key, value)，为None时不缓存
+        scheduler: 工具调用调度器
+        speculative: 是否根据用户消息提前调用weather工具
+        model: 使用的模型
+        compact_results: 是否精简交给模型的工具结果
+    """
+
+    def __init__(
+        self,
+        openai_client,
+        mcp_session=None,
+        tool_cache=None,
+        scheduler: ToolScheduler = None,
+        speculative: bool = SPECULATIVE_TOOLS,
+        model: str = MODEL,
+        compact_results: bool = COMPACT_TOOL_RESULTS,
+    ):
+        self.openai_client = openai_client
+        self.mcp_session = mcp_session
+        self.available_tools = []
+        self.tool_cache = tool_cache
+        self.scheduler = scheduler or ToolScheduler()
+        self.speculative = speculative
+        self.model = model
+        self.compact_results = compact_results
+
+    @property
+    def mcp_available(self):
+        return self.mcp_session is not None
+
+    def get_openai_tools_schema(self):
+        """将MCP工具转化为OpenAI函数调用格式"""
+        if not self.mcp_available or not self.available_tools:
+            return []
+
+        # schema由服务端的inputSchema和工具docstring生成，每个工具版本只生成一次
+        return [SchemaBuilder.mcp_tool_to_schema(tool) for tool in self.available_tools]
+
+    def build_messages(self, user_message: str):
+        """构建系统提示词和用户消息"""
+        system_content = "你是一个智能助手，可以回答各种问题。"
+        if self.mcp_available and self.available_tools:
+            system_content += "你有一些工具可以帮助获取实时信息，如天气查询等。"
+        else:
+            system_content += "虽然你没有实时数据访问能力，但你会基于你的知识尽力回答用户的问题。"
+        return [
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": user_message}
+        ]
+
+    async def call_tool(self, tool_name, parameters):
+        """
+        调用MCP工具
+
+        Returns:
+            工具声明了输出结构时返回structuredContent(dict)，否则返回文本结果
+
+        Raises:
+            Exception: 工具返回错误结果(isError)
+        """
+        if not self.mcp_available:
+            raise Exception("MCP服务器不可用，无法调用工具")
+
+        try:
+            result = await self.mcp_session.call_tool(tool_name, parameters)
+            text = result.content[0].text if result.content else ""
+            if result.isError:
+                raise Exception(text or "工具返回错误")
+            if result.structuredContent is not None:
+                return result.structuredContent
+            return text or "工具调用成功，但无返回结果"
+        except asyncio.CancelledError:
+            # 取消时退出MCP会话上下文会关闭进行中的HTTP请求
+            metrics.inc("mcp_tool_calls_cancelled")
+            logger.info(f"MCP工具调用已取消: {tool_name}")
+            raise
+        except Exception as e:
+            logger.error(f"MCP工具调用异常: {type(e).__name__}: {e}")
+            raise e
+
+    async def cached_call_tool(self, tool_name, parameters):
+        """先查工具结果缓存，未命中再调用MCP工具"""
+        if self.tool_cache is None:
+            return await self.call_tool(tool_name, parameters)
+        key = (tool_name, json.dumps(parameters, sort_keys=True, ensure_ascii=False))
+        result = await cache_get(self.tool_cache, key)
+        if result is None:
+            result = await self.call_tool(tool_name, parameters)
+            await cache_set(self.tool_cache, key, result)
+        else:
+            metrics.inc("tool_cache_hits")
+        return result
+
+    # -------------------------------------------------------- 预取
+
+    def start_speculative_weather(self, user_message: str):
+        """
+        用户消息中只提到一个城市时，提前调用weather工具
+
+        Returns:
+            tuple: (预取使用的参数, 工具调用任务)，不满足条件时返回None
+        """
+        if not self.speculative or not self.mcp_available:
+            return None
+        if not any(tool.name == "weather" for tool in self.available_tools):
+            return None
+
+        cities = extract_cities(user_message)
+        if len(cities) != 1:
+            return None
+
+        arguments = {"city": cities[0]}
+        logger.info(f"预取天气: {arguments}")
+        return arguments, asyncio.create_task(self.cached_call_tool("weather", arguments))
+
+    @staticmethod
+    def speculative_matches(speculative, function_name, function_args) -> bool:
+        """模型的工具调用是否与预取的调用等价"""
+        if speculative is None or function_name != "weather":
+            return False
+        if set(function_args) - {"city", "extensions"}:
+            return False
+        if function_args.get("extensions", "base") != "base":
+            return False
+        code = canonical_city(function_args.get("city", ""))
+        return code is not None and code == canonical_city(speculative[0]["city"])
+
+    @staticmethod
+    def discard_speculative(speculative):
+        """丢弃没有用上的预取任务"""
+        if speculative is None:
+            return
+        task = speculative[1]
+        if task.done():
+            if not task.cancelled():
+                task.exception()
+        else:
+            task.cancel()
+        metrics.inc("speculative_tool_misses")
+
+    # -------------------------------------------------------- OpenAI
+
+    async def create_stream(self, messages, tools, max_tokens):
+        """发起流式的chat completion请求，有工具时带上工具定义"""
+        kwargs = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+        if tools:
+            kwargs["tools"] = tools
+            kwargs["tool_choice"] = "auto"
+        return await self.openai_client.chat.completions.create(**kwargs)
+
+    async def read_stream(self, stream, tool_calls: dict):
+        """
+        读取OpenAI流：文本增量直接产出，工具调用的增量按index拼装到tool_calls中
+
+        生成被取消时立即关闭上游连接
+        """
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    yield delta.content
+                for part in delta.tool_calls or ():
+                    call = tool_calls.setdefault(part.index, {"id": "", "name": "", "arguments": ""})
+                    if part.id:
+                        call["id"] = part.id
+                    if part.function:
+                        call["name"] += part.function.name or ""
+                        call["arguments"] += part.function.arguments or ""
+        finally:
+            await stream.close()
+
+    # -------------------------------------------------------- 工具
+
+    async def execute_tool_call(self, function_name, function_args, speculative):
+        """
+        执行一个已经校验过的工具调用
+
+        Returns:
+            tuple: (是否成功, 结构化结果或文本结果/错误信息)
+        """
+        try:
+            if isinstance(function_args, ToolArgumentError):
+                raise function_args
+            if self.speculative_matches(speculative, function_name, function_args):
+                metrics.inc("speculative_tool_hits")
+                return True, await speculative[1]
+            return True, await self.cached_call_tool(function_name, function_args)
+        except Exception as e:
+            return False, f"工具调用失败: {e}"
+
+    def shape_result(self, function_name, result, text):
+        """
+        交给模型的工具结果只保留回答需要的字段，完整结果仍在tool_result事件中
+
+        Args:
+            result: 工具的结构化结果或文本结果
+            text: 完整结果的文本形式
+        """
+        if not self.compact_results:
+            return text
+        compact = compact_tool_result(function_name, result)
+        metrics.inc("tool_result_chars_saved", len(text) - len(compact))
+        return compact
+
+    # -------------------------------------------------------- 主流程
+
+    async def run(self, user_message: str) -> AsyncIterator[AgentEvent]:
+        """处理一次用户提问，产出事件"""
+        yield StartEvent()
+
+        messages = self.build_messages(user_message)
+        tools = self.get_openai_tools_schema()
+
+        # 预取与首次OpenAI调用并行执行
+        speculative = self.start_speculative_weather(user_message)
+
+        try:
+            # 首次调用也使用流式：没有工具调用时直接输出回答，不再额外请求一次
+            tool_calls = {}
+            content_parts = []
+            stream = await self.create_stream(messages, tools, max_tokens=500)
+            async for text in self.read_stream(stream, tool_calls):
+                if not content_parts:
+                    yield GeneratingEvent()
+                content_parts.append(text)
+                yield ContentEvent(text)
+
+            if tool_calls:
+                calls = [tool_calls[index] for index in sorted(tool_calls)]
+
+                # 在本地校验并修复参数，不合法的调用不再发给MCP服务器
+                validator = get_validator(tools)
+                checked_calls = []
+                for call in calls:
+                    try:
+                        checked_calls.append((call, validator.validate(call["name"], call["arguments"])))
+                    except ToolArgumentError as e:
+                        metrics.inc("tool_arguments_rejected")
+                        checked_calls.append((call, e))
+
+                # 发送工具调用信息
+                yield ToolCallsEvent(tools=[
+                    {
+                        "name": call["name"],
+                        "arguments": call["arguments"] if isinstance(function_args, ToolArgumentError) else function_args
+                    }
+                    for call, function_args in checked_calls
+                ])
+
+                # 添加助手消息
+                messages.append({
+                    "role": "assistant",
+                    "content": "".join(content_parts) or None,
+                    "tool_calls": [{
+                        "id": call["id"],
+                        "type": "function",
+                        "function": {
+                            "name": call["name"],
+                            "arguments": call["arguments"]
+                        }
+                    } for call in calls]
+                })
+
+                # 执行工具调用
+                for call, _ in checked_calls:
+                    yield ToolExecutingEvent(tool_name=call["name"], message=f"正在调用工具: {call['name']}")
+
+                jobs = []
+                for call, function_args in checked_calls:
+                    # 预取任务只能交给第一个与之匹配的工具调用
+                    use = None
+                    if self.speculative_matches(speculative, call["name"], function_args):
+                        use, speculative = speculative, None
+                    jobs.append(self.execute_tool_call(call["name"], function_args, use))
+                results = await self.scheduler.run(jobs)
+
+                for (call, _), (ok, result) in zip(checked_calls, results):
+                    if ok:
+                        # 结构化结果只在这里序列化一次，供客户端展示
+                        text = result if isinstance(result, str) else compact_dumps(result)
+                        content = self.shape_result(call["name"], result, text)
+                        yield ToolResultEvent(tool_name=call["name"], result=text)
+                    else:
+                        content = result
+                        yield ToolErrorEvent(tool_name=call["name"], error=result)
+                    messages.append({
+                        "role": "tool",
+                        "tool_call_id": call["id"],
+                        "content": content
+                    })
+
+                # 第二次调用OpenAI，结合工具返回的内容流式输出最终回答
+                yield GeneratingEvent()
+                stream = await self.create_stream(messages, None, max_tokens=300)
+                async for text in self.read_stream(stream, {}):
+                    yield ContentEvent(text)
+
+            # 发送结束信号
+            yield EndEvent()
+
+        except Exception as e:
+            logger.error(f"对话处理错误: {type(e).__name__}: {str(e)}")
+            yield ErrorEvent(error=f"处理过程中出现错误: {e}")
+        finally:
+            self.discard_speculative(speculative)
@@ -0,0 +1,94 @@
+"""
+启动耗时检查
+
+用 python -X importtime 在全新的子进程中分别导入各个入口模块，统计累计导入耗时，
+超过预算或者提前加载了应当延迟导入的重量级模块时以非零状态码退出，可以放进CI。
+
+用法:
+    python bench_importtime.py            # 检查所有入口模块
+    python bench_importtime.py myMcp -n 5 # 只检查myMcp，取5次中的最小值
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# 各入口模块的冷启动预算(毫秒)，可以用环境变量整体覆盖
+DEFAULT_BUDGET_MS = {
+    "myMcp": 150,
+    "agent_core": 150,
+    "server": 900,
+    "chat_server": 700,
+}
+IMPORT_TIME_BUDGET_MS = os.getenv("IMPORT_TIME_BUDGET_MS")
+
+# 这些模块只应在第一次使用时导入
+DEFERRED_MODULES = ("pandas", "watchdog", "openai")
+# 除server(FastMCP本身会加载MCP客户端)外，入口模块也不应提前导入MCP
+DEFERRED_MCP = "mcp"
+
+
+def measure(module: str):
+    """
+    在子进程中导入模块一次
+
+    Returns:
+        tuple: (累计导入耗时(毫秒), 导入过的模块名集合, 最慢的几个模块)
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    total_us = 0
+    imported = set()
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # 表头
+        name = name.strip()
+        imported.add(name)
+        rows.append((int(cumulative), name))
+        if name == module:
+            total_us = int(cumulative)
+    rows.sort(reverse=True)
+    return total_us / 1000, imported, rows[1:6]
+
+
+def check(module: str, repeat: int) -> bool:
+    budget = float(IMPORT_TIME_BUDGET_MS or DEFAULT_BUDGET_MS.get(module, 500))
+    runs = [measure(module) for _ in range(repeat)]
+    elapsed, imported, slowest = min(runs, key=lambda run: run[0])
+
+    ok = elapsed <= budget
+    print(f"{'OK  ' if ok else 'FAIL'} {module}: {elapsed:.1f}ms (预算 {budget:.0f}ms)")
+    for cumulative, name in slowest:
+        print(f"       {cumulative / 1000:8.1f}ms  {name}")
+
+    deferred = DEFERRED_MODULES if module == "server" else DEFERRED_MODULES + (DEFERRED_MCP,)
+    eager = [name for name in deferred if name in imported]
+    if eager:
+        print(f"FAIL {module}: 启动时提前导入了 {', '.join(eager)}")
+        ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查入口模块的冷启动导入耗时")
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_BUDGET_MS), help="要检查的模块")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="每个模块导入的次数，取最小值")
+    args = parser.parse_args()
+
+    results = [check(module, args.repeat) for module in args.modules]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
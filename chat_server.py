@@ -1,20 +1,25 @@
+import argparse
 import asyncio
+import importlib.util
 import json
 import os
-from typing import AsyncGenerator
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse, FileResponse
+from typing import AsyncGenerator, Optional
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from mcp.client.session import ClientSession
-from mcp.client.streamable_http import streamablehttp_client
 import logging
 
-# 导入现有的MCP Agent
-from myMcp import MCPAgent
+from stream_encoder import NDJSONStreamEncoder, SSEStreamEncoder, WebSocketStreamEncoder
+from stream_hub import StreamHub
+from metrics import metrics
+from agent_core import MODEL, AgentEngine
+from llm_client import create_openai_client, pool_stats
+from warmup import WARMUP_ENABLED, readiness
+from health_probes import PROBE_POOL_SATURATION, PROBE_TIMEOUT, probes
+from tools.cache_backend import cache_get, cache_set, make_cache
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -22,20 +27,30 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# 监听地址和端口
+CHAT_HOST = os.getenv("CHAT_HOST", "0.0.0.0")
+CHAT_PORT = int(os.getenv("CHAT_PORT", "8002"))
+# 生产模式的worker数量，默认1；进行中的回答保存在进程内存中，多个worker共用一个监听端口时，
+# 网页界面的第二个请求(GET /chat/sse/{id})和所有续传请求会落到随机的worker上而返回404
+CHAT_WORKERS = int(os.getenv("CHAT_WORKERS", "1"))
+# 确认客户端只使用单次请求的接口(/chat、POST /chat/stream、不续传的WebSocket)时才允许多worker
+CHAT_ALLOW_SHARED_WORKERS = os.getenv("CHAT_ALLOW_SHARED_WORKERS", "0") == "1"
+# 关闭时等待进行中的回答完成的最长时间(秒)
+CHAT_GRACEFUL_TIMEOUT = float(os.getenv("CHAT_GRACEFUL_TIMEOUT", "30"))
+
 # 全局变量
 openai_client = None
+warmup_task = None
+probe_task = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """应用生命周期管理"""
-    global openai_client
+    """应用生命周期管理，OpenAI客户端由这里创建和关闭，所有请求共用"""
+    global openai_client, warmup_task, probe_task
     
     # 启动时初始化
     try:
-        openai_client = AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            base_url=os.getenv("OPENAI_BASE_URL")
-        )
+        openai_client = create_openai_client()
         logger.info("✅ OpenAI客户端初始化成功")
         
         # 检查环境变量
@@ -54,10 +69,23 @@ async def lifespan(app: FastAPI):
         logger.error(f"❌ 初始化失败: {e}")
         raise e
     
+    # 预热在后台进行，服务器立即开始接受连接，预热完成前 /health 报告未就绪
+    if WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(warm_up())
+    # 依赖探测在后台定期执行，/readyz 只读取缓存的结果
+    probe_task = asyncio.create_task(probes.run())
+    
     yield  # 应用运行
     
-    # 关闭时清理（如果需要）
+    # 关闭时等待已经脱离连接、仍在后台生成的回答，超时后取消
     logger.info("🔄 应用关闭中...")
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    probe_task.cancel()
+    await stream_hub.drain(CHAT_GRACEFUL_TIMEOUT)
+    if openai_client is not None:
+        await openai_client.close()
+        openai_client = None
 
 app = FastAPI(
     title="MCP聊天助手", 
@@ -72,379 +100,350 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 class ChatRequest(BaseModel):
     message: str
 
-async def init_mcp_agent():
-    """初始化MCP Agent"""
-    global openai_client, mcp_agent
-    
-    # 初始化OpenAI客户端
-    openai_client = AsyncOpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL")
-    )
-    
-    mcp_server_url = os.getenv("MCP_SERVER_URL")
+class StreamingChatAgent(AgentEngine):
+    """流式聊天代理，把对话引擎的事件转换为stream_encoder使用的事件字典"""
     
-    if mcp_server_url:
-        try:
-            logger.info(f"尝试连接到MCP服务器: {mcp_server_url}")
-            # 这里我们需要保持连接，所以使用全局连接
-            async with streamablehttp_client(mcp_server_url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as mcp_session:
-                    await mcp_session.initialize()
-                    
-                    # 获取工具
-                    tools_response = await mcp_session.list_tools()
-                    available_tools = tools_response.tools
-                    
-                    logger.info(f"连接成功，可用工具数量: {len(available_tools)}")
-                    
-                    # 创建MCP Agent
-                    mcp_agent = MCPAgent(openai_client, mcp_session)
-                    mcp_agent.available_tools = available_tools
-                    
-                    return mcp_agent
-        except Exception as e:
-            logger.error(f"MCP连接失败: {e}")
-            mcp_agent = MCPAgent(openai_client, None)
-    else:
-        logger.info("未设置MCP_SERVER_URL，使用无MCP模式")
-        mcp_agent = MCPAgent(openai_client, None)
-    
-    return mcp_agent
+    async def stream_chat_with_tools(self, user_message: str) -> AsyncGenerator[dict, None]:
+        """流式聊天，支持工具调用"""
+        async for event in self.run(user_message):
+            yield event.to_dict()
 
-class StreamingChatAgent:
-    """流式聊天代理，基于现有的MCPAgent进行流式改造"""
-    
-    def __init__(self, openai_client, mcp_session=None):
-        self.openai_client = openai_client
-        self.mcp_session = mcp_session
-        self.available_tools = []
-    
-    @property
-    def mcp_available(self):
-        return self.mcp_session is not None
-    
-    def get_openai_tools_schema(self):
-        """复用MCPAgent的工具schema生成逻辑"""
-        if not self.mcp_available or not self.available_tools:
-            return []
-            
-        try:
-            with open("/root/python_learn/mcpServer/schemas.json", "r", encoding="utf-8") as f:
-                schema_params = json.load(f)
-        except FileNotFoundError:
-            schema_params = {}
-        
-        openai_tools = []
-        
-        for tool in self.available_tools:
-            tool_params = schema_params.get(tool.name, {})
-            
-            tool_schema = {
-                "type": "function",
-                "function": {
-                    "name": tool.name,
-                    "description": tool.description or f"MCP tool: {tool.name}",
-                    "parameters": tool_params if tool_params else {
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            }        
-            openai_tools.append(tool_schema)
+def ensure_openai_client():
+    """确保OpenAI客户端已初始化"""
+    global openai_client
+    if openai_client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        base_url = os.getenv("OPENAI_BASE_URL")
         
-        return openai_tools
-    
-    async def call_mcp_tool(self, tool_name, parameters):
-        """调用MCP工具"""
-        if not self.mcp_available or not self.mcp_session:
-            raise Exception("MCP服务器不可用")
+        if not api_key:
+            raise HTTPException(
+                status_code=500, 
+                detail="OPENAI_API_KEY 环境变量未设置，请检查.env文件配置"
+            )
+        if not base_url:
+            raise HTTPException(
+                status_code=500, 
+                detail="OPENAI_BASE_URL 环境变量未设置，请检查.env文件配置"
+            )
             
-        try:    
-            result = await self.mcp_session.call_tool(tool_name, parameters)
-            if result.content and len(result.content) > 0:
-                return result.content[0].text
-            else:
-                return "工具调用成功，但无返回结果"
-        except Exception as e:
-            logger.error(f"MCP工具调用异常: {e}")
-            raise e
+        openai_client = create_openai_client(api_key, base_url)
+        logger.info("OpenAI客户端已初始化")
+    return openai_client
+
+async def list_mcp_tools(mcp_session, mcp_server_url: str):
+    """获取MCP工具列表，优先读取工具列表缓存"""
+    from mcp.types import Tool
+
+    cached = await cache_get(tool_catalog_cache, mcp_server_url)
+    if cached is not None:
+        return [Tool.model_validate(tool) for tool in cached]
+    tools = (await mcp_session.list_tools()).tools
+    await cache_set(tool_catalog_cache, mcp_server_url, [tool.model_dump(mode="json") for tool in tools])
+    return tools
+
+async def warm_llm_connection():
+    """请求一次模型列表，提前完成到LLM服务的TLS握手，连接留在连接池中"""
+    response = await openai_client.with_options(max_retries=0).models.list()
+    return len(response.data)
+
+async def warm_mcp_tools():
+    """初始化一次MCP会话，填充工具列表缓存并生成工具schema"""
+    from mcp.client.session import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+    from openai_schema_builder import SchemaBuilder
+
+    mcp_server_url = os.getenv("MCP_SERVER_URL")
+    async with streamablehttp_client(mcp_server_url) as (read_stream, write_stream, _):
+        async with ClientSession(read_stream, write_stream) as mcp_session:
+            await mcp_session.initialize()
+            tools = await list_mcp_tools(mcp_session, mcp_server_url)
+    for tool in tools:
+        SchemaBuilder.mcp_tool_to_schema(tool)
+    return len(tools)
+
+async def warm_city_index():
+    """加载城市编码表，推测执行识别问题中的城市时不必再读取"""
+    from tools.city2code import warm_index
+    return await asyncio.to_thread(warm_index)
+
+async def warm_up():
+    """并发执行各预热步骤，全部结束后标记就绪"""
+    steps = [
+        readiness.run_step_async("llm_connection", warm_llm_connection),
+        readiness.run_step_async("city_index", warm_city_index),
+    ]
+    if os.getenv("MCP_SERVER_URL"):
+        steps.append(readiness.run_step_async("mcp_tools", warm_mcp_tools))
+    await asyncio.gather(*steps)
+    readiness.mark_ready()
+
+@probes.probe("llm")
+async def probe_llm():
+    """LLM接口：请求模型列表，不重试"""
+    response = await openai_client.with_options(max_retries=0, timeout=PROBE_TIMEOUT).models.list()
+    return {"models": len(response.data)}
+
+@probes.probe("openai_pool")
+async def probe_openai_pool():
+    """OpenAI连接池：占用接近上限时新请求会排队等待连接"""
+    stats = pool_stats(openai_client)
+    if stats and stats["active"] >= stats["max_connections"] * PROBE_POOL_SATURATION:
+        raise RuntimeError(f"连接池已占用 {stats['active']}/{stats['max_connections']}")
+    return stats
+
+async def probe_mcp():
+    """MCP服务器：建立会话并调用list_tools，不读取工具列表缓存"""
+    from mcp.client.session import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    async with streamablehttp_client(os.getenv("MCP_SERVER_URL")) as (read_stream, write_stream, _):
+        async with ClientSession(read_stream, write_stream) as mcp_session:
+            await mcp_session.initialize()
+            tools = (await mcp_session.list_tools()).tools
+    return {"tools": len(tools)}
+
+if os.getenv("MCP_SERVER_URL"):
+    probes.register("mcp", probe_mcp)
+
+async def produce_chat_events(message: str):
+    """所有传输方式共用的事件生产者"""
+    # 为了支持MCP连接，我们需要在每次请求时创建新的连接
+    mcp_server_url = os.getenv("MCP_SERVER_URL")
     
-    async def stream_chat_with_tools(self, user_message: str) -> AsyncGenerator[str, None]:
-        """流式聊天，支持工具调用"""
-        
-        # 发送开始信号
-        yield json.dumps({
-            "type": "start",
-            "message": "开始处理您的问题..."
-        }, ensure_ascii=False) + "\n"
-        
-        # 构建消息
-        system_content = "你是一个智能助手，可以回答各种问题。"
-        if self.mcp_available and self.available_tools:
-            system_content += "你有一些工具可以帮助获取实时信息，如天气查询等。"
-        
-        messages = [
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": user_message}
-        ]
-        
-        tools = self.get_openai_tools_schema()
-        
-        try:
-            # 首次调用OpenAI
-            if tools:
-                response = await self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    tools=tools,
-                    tool_choice="auto",
-                    max_tokens=500
-                )
-            else:
-                response = await self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    max_tokens=500
-                )
-            
-            response_message = response.choices[0].message
-            
-            # 检查是否需要调用工具
-            if response_message.tool_calls:
-                # 发送工具调用信息
-                yield json.dumps({
-                    "type": "tool_calls",
-                    "tools": [
-                        {
-                            "name": tool_call.function.name,
-                            "arguments": json.loads(tool_call.function.arguments)
-                        }
-                        for tool_call in response_message.tool_calls
-                    ]
-                }, ensure_ascii=False) + "\n"
-                
-                # 添加助手消息
-                messages.append({
-                    "role": "assistant",
-                    "content": response_message.content,
-                    "tool_calls": [{
-                        "id": tool_call.id,
-                        "type": tool_call.type,
-                        "function": {
-                            "name": tool_call.function.name,
-                            "arguments": tool_call.function.arguments
-                        }
-                    } for tool_call in response_message.tool_calls]
-                })
-                
-                # 执行工具调用
-                for tool_call in response_message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    yield json.dumps({
-                        "type": "tool_executing",
-                        "tool_name": function_name,
-                        "message": f"正在调用工具: {function_name}"
-                    }, ensure_ascii=False) + "\n"
-                    
-                    try:
-                        tool_result = await self.call_mcp_tool(function_name, function_args)
-                        
-                        yield json.dumps({
-                            "type": "tool_result",
-                            "tool_name": function_name,
-                            "result": str(tool_result)
-                        }, ensure_ascii=False) + "\n"
-                        
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": str(tool_result)
-                        })
-                    except Exception as e:
-                        error_msg = f"工具调用失败: {e}"
-                        yield json.dumps({
-                            "type": "tool_error",
-                            "tool_name": function_name,
-                            "error": error_msg
-                        }, ensure_ascii=False) + "\n"
-                        
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": error_msg
-                        })
-                
-                # 第二次调用OpenAI，获取流式响应
-                yield json.dumps({
-                    "type": "generating",
-                    "message": "正在生成回答..."
-                }, ensure_ascii=False) + "\n"
-                
-                final_response = await self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    max_tokens=300,
-                    stream=True
-                )
+    if mcp_server_url:
+        from mcp.client.session import ClientSession
+        from mcp.client.streamable_http import streamablehttp_client
+
+        async with streamablehttp_client(mcp_server_url) as (read_stream, write_stream, _):
+            async with ClientSession(read_stream, write_stream) as mcp_session:
+                await mcp_session.initialize()
                 
-                # 流式输出最终回答
-                async for chunk in final_response:
-                    if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                        yield json.dumps({
-                            "type": "content",
-                            "content": chunk.choices[0].delta.content
-                        }, ensure_ascii=False) + "\n"
-            else:
-                # 没有工具调用，直接流式输出
-                yield json.dumps({
-                    "type": "generating",
-                    "message": "正在生成回答..."
-                }, ensure_ascii=False) + "\n"
+                # 获取工具
+                available_tools = await list_mcp_tools(mcp_session, mcp_server_url)
                 
-                # 重新调用获取流式响应
-                if tools:
-                    stream_response = await self.openai_client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=messages,
-                        tools=tools,
-                        tool_choice="auto",
-                        max_tokens=500,
-                        stream=True
-                    )
-                else:
-                    stream_response = await self.openai_client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=messages,
-                        max_tokens=500,
-                        stream=True
-                    )
+                # 创建流式代理
+                agent = StreamingChatAgent(openai_client, mcp_session, tool_cache=tool_result_cache)
+                agent.available_tools = available_tools
                 
-                async for chunk in stream_response:
-                    if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                        yield json.dumps({
-                            "type": "content",
-                            "content": chunk.choices[0].delta.content
-                        }, ensure_ascii=False) + "\n"
-            
-            # 发送结束信号
-            yield json.dumps({
-                "type": "end",
-                "message": "回答完成"
-            }, ensure_ascii=False) + "\n"
-            
-        except Exception as e:
-            logger.error(f"流式聊天处理错误: {type(e).__name__}: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            yield json.dumps({
-                "type": "error",
-                "error": f"处理过程中出现错误: {e}"
-            }, ensure_ascii=False) + "\n"
+                # 流式生成响应
+                async for event in agent.stream_chat_with_tools(message):
+                    yield event
+        return
+    
+    # 无MCP模式
+    agent = StreamingChatAgent(openai_client, None)
+    async for event in agent.stream_chat_with_tools(message):
+        yield event
 
-# 全局流式聊天代理
-streaming_agent = None
+# 工具结果缓存，相同参数的工具调用在有效期内不再访问MCP服务器；
+# 后端由CACHE_BACKEND决定，多个worker之间可以共享
+tool_result_cache = make_cache("tool_results", float(os.getenv("TOOL_RESULT_CACHE_TTL", "60")))
+# MCP工具列表缓存，有效期内的请求不再调用list_tools
+tool_catalog_cache = make_cache("tool_catalog", float(os.getenv("TOOL_CATALOG_TTL", "300")))
 
-async def get_streaming_agent():
-    """获取流式聊天代理"""
-    global streaming_agent, openai_client
-    
-    if streaming_agent is None:
-        if openai_client is None:
-            openai_client = AsyncOpenAI(
-                api_key=os.getenv("OPENAI_API_KEY"),
-                base_url=os.getenv("OPENAI_BASE_URL")
-            )
-        
-        mcp_server_url = os.getenv("MCP_SERVER_URL")
-        
-        if mcp_server_url:
-            try:
-                # 这里为了简化，我们每次都创建新连接
-                # 在生产环境中，应该维护长连接
-                streaming_agent = StreamingChatAgent(openai_client, None)
-                logger.info("创建无MCP连接的流式代理")
-            except Exception as e:
-                logger.error(f"创建流式代理失败: {e}")
-                streaming_agent = StreamingChatAgent(openai_client, None)
-        else:
-            streaming_agent = StreamingChatAgent(openai_client, None)
-    
-    return streaming_agent
+# 所有正在生成的回答，各传输方式通过它订阅和续传
+stream_hub = StreamHub()
 
 @app.post("/chat/stream")
 async def chat_stream(request: ChatRequest):
-    """流式聊天接口"""
+    """
+    流式聊天接口
+
+    回答在后台生成，与本次连接无关；响应头 X-Response-ID 和每行的 seq
+    可用于断线后通过 GET /chat/stream/{response_id}?offset= 续传
+    """
     try:
-        # 确保OpenAI客户端已初始化
-        global openai_client
-        if openai_client is None:
-            api_key = os.getenv("OPENAI_API_KEY")
-            base_url = os.getenv("OPENAI_BASE_URL")
-            
-            if not api_key:
-                raise HTTPException(
-                    status_code=500, 
-                    detail="OPENAI_API_KEY 环境变量未设置，请检查.env文件配置"
-                )
-            if not base_url:
-                raise HTTPException(
-                    status_code=500, 
-                    detail="OPENAI_BASE_URL 环境变量未设置，请检查.env文件配置"
-                )
-                
-            openai_client = AsyncOpenAI(
-                api_key=api_key,
-                base_url=base_url
-            )
-            logger.info("OpenAI客户端已初始化")
-        
-        # 为了支持MCP连接，我们需要在每次请求时创建新的连接
-        mcp_server_url = os.getenv("MCP_SERVER_URL")
-        
-        if mcp_server_url:
-            try:
-                async def generate_with_mcp():
-                    async with streamablehttp_client(mcp_server_url) as (read_stream, write_stream, _):
-                        async with ClientSession(read_stream, write_stream) as mcp_session:
-                            await mcp_session.initialize()
-                            
-                            # 获取工具
-                            tools_response = await mcp_session.list_tools()
-                            available_tools = tools_response.tools
-                            
-                            # 创建流式代理
-                            agent = StreamingChatAgent(openai_client, mcp_session)
-                            agent.available_tools = available_tools
-                            
-                            # 流式生成响应
-                            async for chunk in agent.stream_chat_with_tools(request.message):
-                                yield chunk
-                
-                return StreamingResponse(
-                    generate_with_mcp(),
-                    media_type="text/plain",
-                    headers={"Cache-Control": "no-cache"}
-                )
-            except Exception as e:
-                logger.error(f"MCP连接失败，使用无MCP模式: {e}")
-        
-        # 无MCP模式
-        agent = StreamingChatAgent(openai_client, None)
-        
-        return StreamingResponse(
-            agent.stream_chat_with_tools(request.message),
-            media_type="text/plain",
-            headers={"Cache-Control": "no-cache"}
-        )
+        ensure_openai_client()
+        stream = stream_hub.start(produce_chat_events(request.message))
+        return ndjson_response(stream)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"聊天流处理错误: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/chat/stream/{response_id}")
+async def chat_stream_resume(response_id: str, offset: int = 0):
+    """从指定序号开始续传 /chat/stream 的回答，offset 为最后收到的 seq + 1"""
+    stream = stream_hub.get(response_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="回答不存在或已过期")
+    if not stream.can_resume(offset):
+        raise HTTPException(status_code=410, detail="续传位置已过期")
+    return ndjson_response(stream, offset)
+
+def ndjson_response(stream, offset: int = 0):
+    """把回答从指定序号开始以NDJSON格式输出"""
+    return StreamingResponse(
+        NDJSONStreamEncoder(with_seq=True).encode_indexed(stream.subscribe(offset)),
+        media_type="text/plain",
+        headers={"Cache-Control": "no-cache", "X-Response-ID": stream.response_id}
+    )
+
+def sse_response(stream, offset: int = 0):
+    """把回答从指定序号开始以SSE格式输出"""
+    return StreamingResponse(
+        SSEStreamEncoder(stream.response_id).encode_indexed(stream.subscribe(offset)),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # 关闭nginx等反向代理的缓冲
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+def resume_stream(last_event_id: str):
+    """解析 "响应ID:序号" 格式的事件ID，返回回答和续传起点"""
+    response_id, _, seq = last_event_id.rpartition(":")
+    stream = stream_hub.get(response_id)
+    if stream is None or not seq.isdigit():
+        raise HTTPException(status_code=404, detail="回答不存在或已过期")
+    if not stream.can_resume(int(seq) + 1):
+        raise HTTPException(status_code=410, detail="续传位置已过期")
+    return stream, int(seq) + 1
+
+@app.post("/chat/sse/start")
+async def chat_sse_start(request: ChatRequest):
+    """
+    开始生成回答，返回 response_id，浏览器再用EventSource订阅 GET /chat/sse/{response_id}
+
+    消息放在请求体中，不会出现在URL和访问日志里；订阅接口只续传，
+    EventSource断线重试不会再次开始生成
+    """
+    ensure_openai_client()
+    stream = stream_hub.start(produce_chat_events(request.message))
+    return {"response_id": stream.response_id, "events_url": f"/chat/sse/{stream.response_id}"}
+
+@app.get("/chat/sse/{response_id}")
+async def chat_sse_subscribe(response_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    订阅已经开始的回答，兼容浏览器EventSource
+
+    首次连接从头输出，断线重连时EventSource会带上Last-Event-ID，从断点继续输出；
+    Last-Event-ID必须属于路径中的回答，不能借这个接口读取别的回答
+    """
+    if last_event_id:
+        if last_event_id.rpartition(":")[0] != response_id:
+            raise HTTPException(status_code=400, detail="Last-Event-ID与回答ID不一致")
+        return sse_response(*resume_stream(last_event_id))
+    stream = stream_hub.get(response_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="回答不存在或已过期")
+    if not stream.can_resume(0):
+        raise HTTPException(status_code=410, detail="续传位置已过期")
+    return sse_response(stream)
+
+@app.get("/chat/sse")
+async def chat_sse_get(last_event_id: Optional[str] = Header(None)):
+    """只用于按Last-Event-ID续传，开始新的回答请使用 POST /chat/sse 或 POST /chat/sse/start"""
+    if not last_event_id:
+        raise HTTPException(status_code=400, detail="请使用 POST /chat/sse/start 开始回答")
+    return sse_response(*resume_stream(last_event_id))
+
+@app.post("/chat/sse")
+async def chat_sse_post(request: ChatRequest, last_event_id: Optional[str] = Header(None)):
+    """SSE流式聊天接口，消息放在请求体中"""
+    if last_event_id:
+        return sse_response(*resume_stream(last_event_id))
+    
+    ensure_openai_client()
+    return sse_response(stream_hub.start(produce_chat_events(request.message)))
+
+@app.websocket("/chat/ws")
+async def chat_ws(websocket: WebSocket):
+    """
+    WebSocket聊天接口，一条连接上可以同时进行多个会话
+
+    客户端消息:
+        {"action": "chat", "conversation_id": "c1", "message": "..."}
+        {"action": "resume", "conversation_id": "c1", "response_id": "...", "offset": 10}
+    服务端按行发送事件，每个事件带有 conversation_id、response_id 和 seq
+    """
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+    forwarders = {}
+
+    async def forward(conversation_id, stream, offset):
+        encoder = WebSocketStreamEncoder(conversation_id, stream.response_id)
+        events = stream.subscribe(offset)
+        frames = encoder.encode_indexed(events)
+        try:
+            async for frame in frames:
+                async with send_lock:
+                    await websocket.send_text(frame.decode("utf-8"))
+        except (WebSocketDisconnect, RuntimeError) as e:
+            # 转发任务独立运行，发送失败时在这里结束，不让异常留在任务里
+            logger.info(f"会话 {conversation_id} 发送失败，停止转发: {e}")
+        finally:
+            # 立即退订，没有其他订阅者时开始宽限期计时
+            await frames.aclose()
+            try:
+                await events.aclose()
+            except RuntimeError:
+                # 编码器中等待下一个事件的任务正在取消，订阅随它一起结束
+                pass
+            if forwarders.get(conversation_id) is asyncio.current_task():
+                del forwarders[conversation_id]
+
+    async def send_error(conversation_id, error):
+        async with send_lock:
+            await websocket.send_json({
+                "conversation_id": conversation_id,
+                "type": "error",
+                "error": error
+            })
+
+    try:
+        while True:
+            # 一条消息格式错误只回复这个会话的错误，不关闭连接，其他会话继续
+            try:
+                request = json.loads(await websocket.receive_text())
+            except (ValueError, KeyError):
+                await send_error("", "无效的请求: 消息不是JSON文本")
+                continue
+            if not isinstance(request, dict):
+                await send_error("", "无效的请求: 消息必须是JSON对象")
+                continue
+            action = request.get("action", "chat")
+            conversation_id = str(request.get("conversation_id", ""))
+            
+            if action == "resume":
+                stream = stream_hub.get(str(request.get("response_id", "")))
+                if stream is None:
+                    await send_error(conversation_id, "回答不存在或已过期")
+                    continue
+                try:
+                    offset = int(request.get("offset", 0))
+                except (TypeError, ValueError):
+                    await send_error(conversation_id, "无效的请求: offset 必须是整数")
+                    continue
+                if not stream.can_resume(offset):
+                    await send_error(conversation_id, "续传位置已过期")
+                    continue
+            elif action == "chat" and isinstance(request.get("message"), str) and request["message"]:
+                try:
+                    ensure_openai_client()
+                except HTTPException as e:
+                    await send_error(conversation_id, e.detail)
+                    continue
+                stream = stream_hub.start(produce_chat_events(request["message"]))
+                offset = 0
+            else:
+                await send_error(conversation_id, f"无效的请求: {action}")
+                continue
+            
+            # 同一会话的新请求替换旧的转发任务
+            previous = forwarders.pop(conversation_id, None)
+            if previous:
+                previous.cancel()
+            forwarders[conversation_id] = asyncio.create_task(forward(conversation_id, stream, offset))
+    except WebSocketDisconnect:
+        logger.info("WebSocket连接已断开")
+    finally:
+        for task in forwarders.values():
+            task.cancel()
+
 @app.get("/")
 async def get_chat_page():
     """返回聊天页面"""
@@ -452,11 +451,12 @@ async def get_chat_page():
 
 @app.get("/health")
 async def health_check():
-    """健康检查接口"""
-    global openai_client
-    
+    """健康检查接口，进程存活即返回live，预热完成之前返回503"""
+    state = readiness.snapshot()
     status = {
-        "status": "ok",
+        "status": "ok" if state["ready"] else "warming",
+        "live": True,
+        **state,
         "message": "MCP聊天服务器运行正常",
         "openai_client": "已初始化" if openai_client else "未初始化",
         "mcp_server_url": os.getenv("MCP_SERVER_URL", "未配置"),
@@ -466,21 +466,32 @@ async def health_check():
         }
     }
     
-    return status
+    return JSONResponse(status, status_code=200 if state["ready"] else 503)
+
+@app.get("/livez")
+async def livez():
+    """存活探测：事件循环能处理请求即返回200，不检查任何依赖"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """就绪探测：预热完成且依赖探测都正常时返回200，否则503，只读取缓存的探测结果"""
+    state = probes.snapshot()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    """进程内指标，包括OpenAI连接池状态"""
+    return {**metrics.snapshot(), "openai_pool": pool_stats(openai_client)}
 
 @app.post("/test")
 async def test_simple_chat():
     """简单的测试接口，不使用流式响应"""
     try:
-        global openai_client
-        if openai_client is None:
-            openai_client = AsyncOpenAI(
-                api_key=os.getenv("OPENAI_API_KEY"),
-                base_url=os.getenv("OPENAI_BASE_URL")
-            )
+        client = ensure_openai_client()
         
-        response = await openai_client.chat.completions.create(
-            model="gpt-4o-mini",
+        response = await client.chat.completions.create(
+            model=MODEL,
             messages=[{"role": "user", "content": "请简单回复：你好"}],
             max_tokens=50
         )
@@ -498,23 +509,73 @@ async def test_simple_chat():
             "message": "OpenAI连接失败"
         }
 
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="MCP聊天服务器")
+    parser.add_argument("--prod", action="store_true", help="生产模式：不热重载，可用时使用uvloop和httptools")
+    parser.add_argument("--host", default=CHAT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=CHAT_PORT, help="监听端口")
+    parser.add_argument("--workers", type=int, default=CHAT_WORKERS,
+                        help="生产模式的worker数量，默认1；多worker时网页界面和续传不可用，需要同时指定--allow-shared-workers")
+    parser.add_argument("--allow-shared-workers", action="store_true", default=CHAT_ALLOW_SHARED_WORKERS,
+                        help="允许多个worker共用一个端口，仅适用于只调用/chat、POST /chat/stream等单次请求接口的客户端")
+    args = parser.parse_args()
+    if args.prod and args.workers > 1 and not args.allow_shared_workers:
+        parser.error(
+            "多个worker共用一个端口时，网页界面的 GET /chat/sse/{id} 和续传请求会落到没有这个回答的worker上而失败；"
+            "请使用单worker，或每个worker单独一个端口并在前面做会话粘滞；"
+            "确认客户端只使用单次请求的接口时可加 --allow-shared-workers"
+        )
+    return args
+
+def preload_shared_state():
+    """
+    主进程在派生worker之前准备共享的数据
+
+    uvicorn的worker是重新启动的进程，不能直接继承主进程的内存；
+    这里先把城市编码表写入持久化缓存，每个worker启动时直接从磁盘读取，不必各自解析Excel
+    """
+    from tools.city2code import load_adcode_index
+    try:
+        load_adcode_index()
+    except Exception as e:
+        logger.warning(f"预加载城市编码表失败: {e}")
+
+def serving_options(prod: bool, workers: int) -> dict:
+    """开发模式单进程热重载；生产模式不热重载，可用时使用uvloop和httptools"""
+    if not prod:
+        return {"reload": True}
+    return {
+        "workers": max(1, workers),
+        "loop": "uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        "http": "httptools" if importlib.util.find_spec("httptools") else "h11",
+        # 收到SIGTERM后停止接受新连接，最多等待这么久让进行中的流式回答写完
+        "timeout_graceful_shutdown": int(CHAT_GRACEFUL_TIMEOUT),
+        "access_log": False,
+    }
+
 if __name__ == "__main__":
     import uvicorn
     
-    # 初始化OpenAI客户端
-    if openai_client is None:
-        openai_client = AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            base_url=os.getenv("OPENAI_BASE_URL")
-        )
+    args = parse_arguments()
+    options = serving_options(args.prod, args.workers)
     
-    logger.info("启动MCP聊天服务器...")
-    logger.info("访问 http://localhost:8002 开始聊天")
+    # OpenAI客户端由各worker在lifespan中创建，主进程不需要导入openai
+    logger.info(f"启动MCP聊天服务器({'生产' if args.prod else '开发'}模式)...")
+    if args.prod:
+        preload_shared_state()
+        logger.info(f"worker: {options['workers']}，事件循环: {options['loop']}，HTTP解析: {options['http']}")
+        if options["workers"] > 1:
+            logger.warning(
+                "多个worker共用一个端口：网页界面(POST /chat/sse/start 之后的 GET /chat/sse/{id})和续传请求"
+                "(/chat/stream/{id}、SSE Last-Event-ID、WebSocket resume)会落到随机的worker上而返回404，"
+                "只有单次请求的接口可用"
+            )
+    logger.info(f"访问 http://localhost:{args.port} 开始聊天")
     
     uvicorn.run(
         "chat_server:app",
-        host="0.0.0.0",
-        port=8002,
-        reload=True,
-        log_level="info"
+        host=args.host,
+        port=args.port,
+        log_level="info",
+        **options
     )
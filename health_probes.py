@@ -0,0 +1,156 @@
+"""
+依赖探测
+
+后台定期探测服务依赖的上游(MCP服务器、LLM接口、高德等)并缓存结果，
+/readyz 只读取缓存的结果，不会因为上游变慢而阻塞；上游故障时返回503，
+负载均衡不再把流量转给这个实例。/livez 只说明进程还能响应请求。
+"""
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import time
+
+from metrics import metrics
+from warmup import readiness
+
+logger = logging.getLogger(__name__)
+
+# 两次探测之间的间隔(秒)
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", "10"))
+# 单个探测的超时(秒)
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "3"))
+# 连接池占用超过这个比例时连接池探测失败
+PROBE_POOL_SATURATION = float(os.getenv("PROBE_POOL_SATURATION", "0.9"))
+# 只报告、不影响就绪的探测，逗号分隔，例如 "llm"
+PROBE_OPTIONAL = {name.strip() for name in os.getenv("PROBE_OPTIONAL", "").split(",") if name.strip()}
+# 默认只报告的探测中需要影响就绪的，逗号分隔，例如 "amap"
+PROBE_REQUIRED = {name.strip() for name in os.getenv("PROBE_REQUIRED", "").split(",") if name.strip()}
+
+
+def _describe(error: BaseException) -> str:
+    """错误说明，MCP客户端的TaskGroup会把真正的错误包在异常组里"""
+    while getattr(error, "exceptions", None):
+        error = error.exceptions[0]
+    return str(error) or type(error).__name__
+
+
+class ProbeMonitor:
+    """
+    定期执行依赖探测并缓存结果
+
+    探测函数可以是普通函数(在线程中执行)或协程函数，返回值作为说明，抛出异常表示失败。
+    所有实例共用的上游(例如高德)故障时，如果影响就绪，负载均衡会摘除全部实例，
+    这类探测注册为optional，只报告不影响就绪
+
+    Args:
+        interval: 探测间隔(秒)
+        timeout: 单个探测的超时(秒)
+        optional: 额外只报告的探测名
+        required: 注册为optional但需要影响就绪的探测名
+    """
+
+    def __init__(
+        self,
+        interval: float = PROBE_INTERVAL,
+        timeout: float = PROBE_TIMEOUT,
+        optional=PROBE_OPTIONAL,
+        required=PROBE_REQUIRED,
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.optional = set(optional)
+        self.required = set(required)
+        self._probes = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, func, optional: bool = False):
+        """注册一个探测，optional为True时默认只报告、不影响就绪"""
+        self._probes[name] = func
+        if optional:
+            self.optional.add(name)
+
+    def probe(self, name: str, optional: bool = False):
+        """以装饰器方式注册探测"""
+        def decorator(func):
+            self.register(name, func, optional)
+            return func
+        return decorator
+
+    def is_optional(self, name: str) -> bool:
+        return name in self.optional and name not in self.required
+
+    async def _check(self, name: str, func):
+        started = time.monotonic()
+        try:
+            if inspect.iscoroutinefunction(func):
+                detail = await asyncio.wait_for(func(), self.timeout)
+            else:
+                detail = await asyncio.wait_for(asyncio.to_thread(func), self.timeout)
+            result = {"ok": True}
+            if detail is not None:
+                result["detail"] = detail
+        except asyncio.TimeoutError:
+            result = {"ok": False, "error": f"超过 {self.timeout} 秒未响应"}
+        except Exception as e:
+            result = {"ok": False, "error": _describe(e)}
+        result["ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["checked_at"] = time.time()
+
+        with self._lock:
+            previous = self._results.get(name)
+            self._results[name] = result
+        if not result["ok"]:
+            metrics.inc(f"probe_{name}_failures")
+        if previous is None or previous["ok"] != result["ok"]:
+            log = logger.info if result["ok"] else logger.warning
+            log(f"依赖探测 {name}: {'正常' if result['ok'] else result['error']}")
+
+    async def refresh(self):
+        """并发执行一轮所有探测"""
+        await asyncio.gather(*(self._check(name, func) for name, func in self._probes.items()))
+
+    async def run(self):
+        """循环探测，直到任务被取消"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"依赖探测出错: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start_thread(self):
+        """在独立线程的事件循环中循环探测，供没有自己事件循环的服务使用"""
+        thread = threading.Thread(target=asyncio.run, args=(self.run(),), name="probes", daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot(self) -> dict:
+        """
+        汇总缓存的探测结果
+
+        结果超过3个探测间隔没有更新(探测循环停止)时视为失败
+
+        Returns:
+            dict: ready 为预热完成且所有必需探测都正常
+        """
+        now = time.time()
+        with self._lock:
+            results = {name: dict(result) for name, result in self._results.items()}
+        for name in self._probes:
+            result = results.setdefault(name, {"ok": False, "error": "尚未探测"})
+            if result.get("checked_at") and now - result["checked_at"] > 3 * self.interval:
+                result["ok"] = False
+                result["error"] = "探测结果已过期"
+            if self.is_optional(name):
+                result["optional"] = True
+        ready = readiness.ready and all(
+            result["ok"] for name, result in results.items() if not self.is_optional(name)
+        )
+        return {"ready": ready, "warmed_up": readiness.ready, "probes": results}
+
+
+# 进程内的探测器，chat_server 和 server.py 各自注册自己的依赖
+probes = ProbeMonitor()
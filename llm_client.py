@@ -0,0 +1,98 @@
+"""
+OpenAI客户端
+
+进程内只创建一个 AsyncOpenAI，底层的 httpx 连接池、HTTP/2、超时和重试都在这里
+显式配置：聊天服务器由 lifespan 创建和关闭，命令行由 main 创建，所有代码路径共用
+同一个客户端，请求复用已经建立的连接，不再每次都重新握手。
+"""
+import importlib.util
+import logging
+import os
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 连接池：最大连接数、最多保留的空闲长连接数、空闲连接的保留时间(秒)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# 是否启用HTTP/2多路复用，需要安装h2，未安装时退回HTTP/1.1
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "1") == "1"
+# 超时(秒)：建立连接、两次读取之间(流式输出时即token间隔)、写入请求、等待连接池
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+OPENAI_WRITE_TIMEOUT = float(os.getenv("OPENAI_WRITE_TIMEOUT", "10"))
+OPENAI_POOL_TIMEOUT = float(os.getenv("OPENAI_POOL_TIMEOUT", "5"))
+# 连接错误、429和5xx的重试次数，SDK按指数退避重试
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+
+async def _on_request(request):
+    metrics.inc("openai_http_requests")
+
+
+async def _on_response(response):
+    metrics.inc(f"openai_http_responses_{response.status_code // 100}xx")
+
+
+def create_openai_client(api_key: str = None, base_url: str = None):
+    """
+    创建配置好连接池的AsyncOpenAI客户端，openai在第一次使用时才导入
+
+    Args:
+        api_key: 默认读取OPENAI_API_KEY
+        base_url: 默认读取OPENAI_BASE_URL
+
+    Returns:
+        AsyncOpenAI: 用完后需要 await client.close() 关闭连接池
+    """
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    http2 = OPENAI_HTTP2 and importlib.util.find_spec("h2") is not None
+    if OPENAI_HTTP2 and not http2:
+        logger.info("未安装h2，OpenAI客户端使用HTTP/1.1")
+
+    http_client = DefaultAsyncHttpxClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=OPENAI_CONNECT_TIMEOUT,
+            read=OPENAI_READ_TIMEOUT,
+            write=OPENAI_WRITE_TIMEOUT,
+            pool=OPENAI_POOL_TIMEOUT,
+        ),
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+    return AsyncOpenAI(
+        api_key=api_key or os.getenv("OPENAI_API_KEY"),
+        base_url=base_url or os.getenv("OPENAI_BASE_URL"),
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+
+def pool_stats(client) -> dict:
+    """
+    读取客户端连接池的状态，供 /metrics 输出
+
+    依赖httpx/httpcore的内部属性，版本不兼容时返回空字典
+    """
+    if client is None:
+        return {}
+    try:
+        connections = client._client._transport._pool.connections
+    except AttributeError:
+        return {}
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "max_connections": OPENAI_MAX_CONNECTIONS,
+    }
@@ -0,0 +1,32 @@
+"""
+进程内指标
+
+简单的线程安全计数器，chat_server 和 server.py 都可以使用，
+通过各自的 /metrics 接口以JSON形式输出。
+"""
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """按名称累加的计数器集合"""
+
+    def __init__(self):
+        self._counters = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+
+# 全局指标实例
+metrics = Metrics()
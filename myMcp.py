@@ -1,12 +1,16 @@
 import asyncio
 import os
-import json
 import argparse
-from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from mcp.client.session import ClientSession
-from mcp.client.streamable_http import streamablehttp_client
 import traceback #异常处理
+from agent_core import (
+    AgentEngine,
+    ContentEvent,
+    ErrorEvent,
+    ToolCallsEvent,
+    ToolErrorEvent,
+    ToolResultEvent,
+)
 
 
 load_dotenv()
@@ -17,112 +21,10 @@ question = []
 
 DEFAULT_QUESTION = ["现在深圳的天气怎么样？"]
 
-class MCPAgent():
-    def __init__(self, openai_client, mcp_session=None):
-        self.openai_client = openai_client
-        self.mcp_session = mcp_session
-        self.available_tools = []
+class MCPAgent(AgentEngine):
+    """命令行智能体：消费对话引擎的事件，打印工具调用过程并返回完整回答"""
 
-
-
-    @property
-    def mcp_available(self):
-        return self.mcp_session is not None
-
-
-
-    def get_openai_tools_schema(self):
-        """
-        将MCP工具转化为OpenAI函数调用格式
-        """
-        if not self.mcp_available or not self.available_tools:
-            print("MCP不可用或无可用工具，返回空工具列表")
-            return []
-            
-        try:
-            # 加载schema参数定义
-            try:
-                with open("schemas.json", "r", encoding="utf-8") as f:
-                    schema_params = json.load(f)
-            except FileNotFoundError:
-                print("schemas.json文件未找到，使用默认schema")
-                schema_params = {}
-            
-            openai_tools = []
-            print(f"开始构建OpenAI工具schema，可用工具数量: {len(self.available_tools)}")
-            
-            for tool in self.available_tools:
-                print(f"处理工具: '{tool.name}'")
-                
-                # 获取该工具的schema参数
-                tool_params = schema_params.get(tool.name, {})
-                
-                # 构建OpenAI工具的schema
-                tool_schema = {
-                    "type": "function",
-                    "function": {
-                        "name": tool.name,
-                        "description": tool.description or f"MCP tool: {tool.name}",
-                        "parameters": tool_params if tool_params else self._get_default_schema(tool)
-                    }
-                }        
-                openai_tools.append(tool_schema)
-            
-            print(f"总共构建了 {len(openai_tools)} 个工具schema")
-            return openai_tools
-            
-        except Exception as e:
-            print(f"构建工具schema错误: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
-
-    def _get_default_schema(self, tool):
-        """为工具生成默认的schema"""
-        return {
-            "type": "object",
-            "properties": {},
-            "required": []
-        }
-
-    async def call_map_tool(self, tool_name, parameters):
-        if not self.mcp_available or not self.mcp_session:
-            raise Exception("MCP服务器不可用，无法调用工具")
-            
-        try:    
-            # 获取工具详细信息
-            result = await self.mcp_session.call_tool(tool_name, parameters)
-
-            if result.content and len(result.content) > 0:
-                content_text = result.content[0].text
-                # print(f"工具返回内容: {content_text}")
-                return content_text
-            else:
-                return "工具调用成功，但无返回结果"
-                
-        except Exception as e:
-            print(f"MCP工具调用异常: {type(e).__name__}: {str(e)}")
-            raise e
-    
     async def chat_with_tools(self, user_message):
-        #初始化系统提示词
-        system_content = "你是一个智能助手，可以回答各种问题。"
-        if self.mcp_available and self.available_tools:
-            system_content += "你有一些工具可以帮助获取实时信息，如天气查询等。"
-        else:
-            system_content += "虽然你没有实时数据访问能力，但你会基于你的知识尽力回答用户的问题。"
-            
-        messages = [
-            {
-                "role": "system", 
-                "content": system_content
-            },
-            {
-                "role":"user",
-                "content":user_message
-            }
-        ]
-
         tools = self.get_openai_tools_schema()
         print(f"🎯 准备调用OpenAI，传递工具数量: {len(tools)}")
         if tools:
@@ -132,87 +34,22 @@ class MCPAgent():
         else:
             print("没有工具传递给OpenAI（MCP不可用或无可用工具）")
 
-        try:
-            #首次调用openAI
-            print("开始调用OpenAI API...")
-            
-            # 根据是否有工具来决定调用参数
-            if tools:
-                respond = await self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages = messages,
-                    tools = tools,
-                    tool_choice="auto",
-                    max_tokens=500
-                )
-            else:
-                # 没有工具时不传递tools参数
-                respond = await self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages = messages,
-                    max_tokens=500
-                )            
-            respond_message = respond.choices[0].message 
-            print(f"工具调用数量: {len(respond_message.tool_calls) if respond_message.tool_calls else 0}")
-            print(f"OpenAI响应消息: {respond_message}")
-            
-            #检查是否需要调用工具
-            if respond_message.tool_calls:
-                messages.append({
-                    "role":"assistant",
-                    "content": respond_message.content,
-                    "tool_calls":[{
-                        "id": tool_call.id,
-                        "type":tool_call.type, 
-                        "function":{
-                            "name":tool_call.function.name,
-                            "arguments":tool_call.function.arguments
-                        }
-                    }for tool_call in respond_message.tool_calls]
-                })
-
-
-                for tool_call in respond_message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    print(f"调用工具: {function_name}")
-                    print(f"工具参数: {function_args}")
-
-                    try:
-                        tool_result = await self.call_map_tool(function_name, function_args)
-                        
-                        #记录工具调用结果
-                        messages.append({
-                            "role":"tool",
-                            "tool_call_id":tool_call.id,
-                            "content":str(tool_result)
-                        })
-                    except Exception as e:
-                        error_msg = f"工具调用失败: {e}"
-                        print(error_msg)
-                        print(f"错误详情: {type(e).__name__}: {str(e)}")
-                        
-                        #记录工具调用失败结果
-                        messages.append({
-                            "role":"tool",
-                            "tool_call_id":tool_call.id,
-                            "content":error_msg
-                        })
-                print(f"二次调用OpenAI前的messages:")
-                for message in messages:
-                    print(message)
-                #第二次调用 OpenAI,结合用户提问和MCP工具返回的内容
-                final_response = await self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages = messages,
-                    max_tokens = 300
-                )
-                return final_response.choices[0].message.content
-            else:
-                return respond_message.content 
-        except Exception as e:
-            return f"对话过程中出现错误:{e}"
+        answer = []
+        async for event in self.run(user_message):
+            if isinstance(event, ToolCallsEvent):
+                print(f"工具调用数量: {len(event.tools)}")
+                for tool in event.tools:
+                    print(f"调用工具: {tool['name']}")
+                    print(f"工具参数: {tool['arguments']}")
+            elif isinstance(event, ToolResultEvent):
+                print(f"工具 {event.tool_name} 返回: {event.result}")
+            elif isinstance(event, ToolErrorEvent):
+                print(event.error)
+            elif isinstance(event, ContentEvent):
+                answer.append(event.content)
+            elif isinstance(event, ErrorEvent):
+                return f"对话过程中出现错误:{event.error}"
+        return "".join(answer)
 
         
 
@@ -221,12 +58,22 @@ class MCPAgent():
 
 
 async def main():
+    # openai客户端导入较慢，放到真正运行时再导入，-h等短命令可以立即返回
+    from llm_client import create_openai_client
+
+    # 所有问题共用一个客户端，复用同一个连接池
+    openai_client = create_openai_client()
+    try:
+        await run_agent(openai_client)
+    finally:
+        await openai_client.close()
+
+
+async def run_agent(openai_client):
+    # MCP客户端同样在运行时才导入
+    from mcp.client.session import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
 
-    openai_client = AsyncOpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL")
-    )
-    
     agent = None
     mcp_connection_success = False
     
@@ -1,8 +1,355 @@
+import collections.abc
+import dataclasses
 import inspect
 import json
-from typing import get_type_hints, get_origin, get_args, Union
-from dataclasses import dataclass
+import re
+import sys
 from enum import Enum
+from functools import lru_cache
+from types import UnionType
+from typing import Annotated, Any, Literal, Union, get_args, get_origin, get_type_hints
+
+
+
+def _pydantic_base_model():
+    '''
+    pydantic是可选依赖，而且导入较慢：只有已经被导入时参数才可能是pydantic模型，
+    这里直接从sys.modules读取，不主动导入
+    '''
+    module = sys.modules.get("pydantic")
+    return getattr(module, "BaseModel", None)
+
+
+# docstring中参数说明所在的小节
+_ARGS_SECTIONS = ("Args:", "Arguments:", "Parameters:")
+# 参数说明行: "name: 描述" 或 "name (类型): 描述"
+_ARG_LINE = re.compile(r"^(\w+)\s*(?:\([^)]*\))?\s*[:：]\s*(.*)$")
+# 描述中的枚举提示，例如 "可选值:base/all"
+_ENUM_HINT = re.compile(r"可选值\s*[:：]\s*([\w-]+(?:/[\w-]+)+)")
+
+
+def parse_docstring(doc: str):
+    '''
+    解析Google风格的docstring
+
+    Args:
+        doc: 函数或工具的docstring
+
+    Returns:
+        tuple: (摘要, {参数名: 参数说明})，摘要是第一个小节之前的文字
+    '''
+    lines = inspect.cleandoc(doc or "").splitlines()
+    summary = []
+    args = {}
+    section = None
+    current = None
+    for line in lines:
+        stripped = line.strip()
+        if not line.startswith((" ", "\t")) and stripped.endswith(":") and " " not in stripped:
+            section = stripped
+            current = None
+            continue
+        if section is None:
+            summary.append(stripped)
+        elif section in _ARGS_SECTIONS and stripped:
+            match = _ARG_LINE.match(stripped)
+            if match:
+                current = match.group(1)
+                args[current] = match.group(2).strip()
+            elif current:
+                # 参数说明换行的续行
+                args[current] = f"{args[current]} {stripped}".strip()
+    return " ".join(part for part in summary if part).strip(), args
+
+
+def _strip_titles(schema):
+    '''去掉pydantic生成的title字段，只保留对模型有用的信息'''
+    if isinstance(schema, list):
+        return [_strip_titles(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    result = {}
+    for key, value in schema.items():
+        if key == "title":
+            continue
+        if key in ("properties", "$defs", "definitions") and isinstance(value, dict):
+            # 这里的键是属性名/类型名，可能正好叫title，不能当成字段过滤
+            result[key] = {name: _strip_titles(prop) for name, prop in value.items()}
+        else:
+            result[key] = _strip_titles(value)
+    return result
+
+
+_BASIC_TYPES = {
+    int: {"type": "integer"},
+    float: {"type": "number"},
+    str: {"type": "string"},
+    bool: {"type": "boolean"},
+    list: {"type": "array"},
+    dict: {"type": "object"},
+}
+_JSON_TYPE_NAMES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+_SEQUENCE_ORIGINS = (collections.abc.Sequence, collections.abc.Set, collections.abc.Iterable)
+_MAPPING_ORIGINS = (collections.abc.Mapping,)
+
+# 按工具名和版本缓存生成好的schema，版本由inputSchema和描述决定
+_tool_schema_cache = {}
+
+
+class SchemaCompiler:
+    """
+    把Python类型编译成JSON Schema
+
+    枚举、dataclass和pydantic模型收集到$defs中按类型去重，不同模块的同名类型
+    在名字后加序号区分；编译结束后只被引用一次的定义再内联回原处，生成的schema尽量紧凑
+
+    Args:
+        strip_titles: 是否去掉pydantic生成的title字段
+    """
+
+    def __init__(self, strip_titles: bool = True):
+        self.strip_titles = strip_titles
+        self.defs = {}
+        # 类型 -> 在$defs中的名字
+        self._names = {}
+
+    def compile(self, py_type):
+        """编译一个类型，返回可能包含$ref的schema"""
+        if py_type is inspect.Parameter.empty or py_type is Any:
+            return {}
+        if py_type is None or py_type is type(None):
+            return {"type": "null"}
+        if py_type in _BASIC_TYPES:
+            return dict(_BASIC_TYPES[py_type])
+
+        origin = get_origin(py_type)
+        args = get_args(py_type)
+
+        # Annotated[X, "说明"]：字符串元数据作为描述
+        if origin is Annotated:
+            schema = self.compile(args[0])
+            notes = [meta for meta in args[1:] if isinstance(meta, str)]
+            if notes:
+                schema = {**schema, "description": " ".join(notes)}
+            return schema
+
+        # Optional[X] / X | None 只保留非None的类型
+        if origin is Union or origin is UnionType:
+            non_none_args = [arg for arg in args if arg is not type(None)]
+            if len(non_none_args) == 1:
+                return self.compile(non_none_args[0])
+            return {"anyOf": [self.compile(arg) for arg in non_none_args]}
+
+        if origin is Literal:
+            return _enum_schema(list(args))
+
+        if origin in (list, set, frozenset, tuple) or origin in _SEQUENCE_ORIGINS:
+            items = [arg for arg in args if arg is not Ellipsis]
+            schema = {"type": "array"}
+            if len(set(items)) == 1:
+                schema["items"] = self.compile(items[0])
+            elif items:
+                schema["items"] = {"anyOf": [self.compile(arg) for arg in items]}
+            return schema
+
+        if origin in (dict,) or origin in _MAPPING_ORIGINS:
+            schema = {"type": "object"}
+            if len(args) == 2 and args[1] is not Any:
+                schema["additionalProperties"] = self.compile(args[1])
+            return schema
+
+        if inspect.isclass(py_type):
+            if issubclass(py_type, Enum):
+                return self._ref(py_type, lambda: _enum_schema([member.value for member in py_type]))
+            if dataclasses.is_dataclass(py_type):
+                return self._ref(py_type, lambda: self._dataclass_schema(py_type))
+            base_model = _pydantic_base_model()
+            if base_model is not None and issubclass(py_type, base_model):
+                return self._ref(py_type, lambda: self._pydantic_schema(py_type))
+
+        # 无法识别的类型按字符串处理
+        return {"type": "string"}
+
+    def _def_name(self, name: str) -> str:
+        """$defs中还没有被占用的名字，重名时加序号"""
+        unique, index = name, 2
+        while unique in self.defs:
+            unique = f"{name}{index}"
+            index += 1
+        return unique
+
+    def _ref(self, cls, build):
+        """命名类型放进$defs，同一个类型只编译一次"""
+        name = self._names.get(cls)
+        if name is None:
+            name = self._names[cls] = self._def_name(cls.__name__)
+            # 先占位，自引用的模型编译时不会无限递归
+            self.defs[name] = {}
+            self.defs[name] = build()
+        return {"$ref": f"#/$defs/{name}"}
+
+    def _dataclass_schema(self, cls):
+        try:
+            hints = get_type_hints(cls, include_extras=True)
+        except Exception:
+            hints = {}
+        properties = {}
+        required = []
+        for field in dataclasses.fields(cls):
+            prop = self.compile(hints.get(field.name, str))
+            if field.default is not dataclasses.MISSING:
+                prop = _with_default(prop, field.default)
+            elif field.default_factory is dataclasses.MISSING:
+                required.append(field.name)
+            properties[field.name] = prop
+        return {"type": "object", "properties": properties, "required": required}
+
+    def _pydantic_schema(self, cls):
+        schema = cls.model_json_schema(ref_template="#/$defs/{model}")
+        if self.strip_titles:
+            schema = _strip_titles(schema)
+        nested = schema.pop("$defs", {})
+        renames = {}
+        # 自引用的模型，pydantic把模型本身也放进了$defs，顶层只剩一个$ref
+        ref = schema.get("$ref", "")
+        if set(schema) == {"$ref"} and ref.startswith("#/$defs/") and ref.rsplit("/", 1)[-1] in nested:
+            own = ref.rsplit("/", 1)[-1]
+            schema = nested.pop(own)
+            renames[own] = self._names[cls]
+        # 模型内部的嵌套定义合并到同一个$defs中，与已有的不同定义重名时换一个名字
+        added = []
+        for name, definition in nested.items():
+            if name in self.defs:
+                if self.defs[name] == definition:
+                    continue
+                renames[name] = self._def_name(name)
+            else:
+                renames[name] = name
+            self.defs[renames[name]] = {}
+            added.append(name)
+        for name in added:
+            self.defs[renames[name]] = _rename_refs(nested[name], renames)
+        return _rename_refs(schema, renames)
+
+    def finish(self, schema: dict) -> dict:
+        """
+        收尾：只引用一次的定义内联回原处，其余定义挂到schema的$defs下
+
+        Returns:
+            dict: 最终的schema
+        """
+        nodes = [schema, *self.defs.values()]
+        inline = {
+            name for name, definition in self.defs.items()
+            # 自引用的定义不能内联
+            if sum(_count_refs(node, name) for node in nodes) == 1 and _count_refs(definition, name) == 0
+        }
+
+        def resolve(node):
+            if isinstance(node, list):
+                return [resolve(item) for item in node]
+            if not isinstance(node, dict):
+                return node
+            ref = node.get("$ref", "")
+            name = ref.rsplit("/", 1)[-1]
+            if ref.startswith("#/$defs/") and name in inline:
+                extra = {key: value for key, value in node.items() if key != "$ref"}
+                return {**resolve(self.defs[name]), **extra}
+            return {key: resolve(value) for key, value in node.items()}
+
+        schema = resolve(schema)
+        remaining = {name: resolve(definition) for name, definition in self.defs.items() if name not in inline}
+        if remaining:
+            schema["$defs"] = remaining
+        return schema
+
+
+def _enum_schema(values):
+    '''枚举值全部同类型时带上type'''
+    types = {_JSON_TYPE_NAMES.get(type(value)) for value in values}
+    schema = {"enum": values}
+    if len(types) == 1 and None not in types:
+        schema = {"type": types.pop(), "enum": values}
+    return schema
+
+
+def _with_default(schema, default):
+    '''能序列化成JSON的默认值写入schema'''
+    if isinstance(default, Enum):
+        default = default.value
+    try:
+        json.dumps(default)
+    except (TypeError, ValueError):
+        return schema
+    return {**schema, "default": default}
+
+
+def _rename_refs(node, renames):
+    '''按 {原名: 新名} 改写schema中的$ref'''
+    if isinstance(node, list):
+        return [_rename_refs(item, renames) for item in node]
+    if not isinstance(node, dict):
+        return node
+    result = {key: _rename_refs(value, renames) for key, value in node.items()}
+    ref = node.get("$ref", "")
+    name = ref.rsplit("/", 1)[-1]
+    if ref.startswith("#/$defs/") and name in renames:
+        result["$ref"] = f"#/$defs/{renames[name]}"
+    return result
+
+
+def _count_refs(node, name):
+    '''统计schema中对某个定义的引用次数'''
+    if isinstance(node, list):
+        return sum(_count_refs(item, name) for item in node)
+    if not isinstance(node, dict):
+        return 0
+    own = 1 if node.get("$ref") == f"#/$defs/{name}" else 0
+    return own + sum(_count_refs(value, name) for value in node.values())
+
+
+@lru_cache(maxsize=None)
+def _compile_function(func, tool_name, description):
+    '''按函数对象编译schema，同一个函数只做一次签名和类型解析'''
+    sig = inspect.signature(func)
+    try:
+        type_hints = get_type_hints(func, include_extras=True)
+    except Exception:
+        type_hints = {}
+    summary, arg_docs = parse_docstring(func.__doc__)
+
+    compiler = SchemaCompiler()
+    properties = {}
+    required = []
+    for param_name, param in sig.parameters.items():
+        # 跳过self参数和*args/**kwargs
+        if param_name in ("self", "cls") or param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+
+        param_schema = compiler.compile(type_hints.get(param_name, str))
+        if param_name in arg_docs:
+            param_schema = {**param_schema, "description": arg_docs[param_name]}
+
+        # 判断是否为必需参数，可选参数带上默认值
+        if param.default is inspect.Parameter.empty:
+            required.append(param_name)
+        elif param.default is not None:
+            param_schema = _with_default(param_schema, param.default)
+        properties[param_name] = param_schema
+
+    parameters = compiler.finish({
+        "type": "object",
+        "properties": properties,
+        "required": required
+    })
+    return {
+        "type": "function",
+        "function": {
+            "name": tool_name or func.__name__,
+            "description": description or summary or f"函数 {func.__name__}",
+            "parameters": parameters
+        }
+    }
 
 
 class SchemaBuilder:
@@ -10,101 +357,75 @@ class SchemaBuilder:
     
     @staticmethod
     def python_type_to_json_schema(py_type):
-        """将Python类型转换为JSON Schema类型"""
-        type_mapping = {
-            int: {"type": "integer"},
-            float: {"type": "number"},
-            str: {"type": "string"},
-            bool: {"type": "boolean"},
-            list: {"type": "array"},
-            dict: {"type": "object"},
-        }
-        
-        # 处理基本类型
-        if py_type in type_mapping:
-            return type_mapping[py_type]
-        
-        # 处理Union类型 (例如 Optional[str] = Union[str, None])
-        if get_origin(py_type) is Union:
-            args = get_args(py_type)
-            # 过滤掉None类型
-            non_none_args = [arg for arg in args if arg is not type(None)]
-            if len(non_none_args) == 1:
-                return SchemaBuilder.python_type_to_json_schema(non_none_args[0])
-        
-        # 处理List类型
-        if get_origin(py_type) is list:
-            args = get_args(py_type)
-            if args:
-                return {
-                    "type": "array",
-                    "items": SchemaBuilder.python_type_to_json_schema(args[0])
-                }
-            return {"type": "array"}
-        
-        # 默认返回string类型
-        return {"type": "string"}
+        """
+        将Python类型转换为JSON Schema
+
+        支持基本类型、Optional/Union、Literal、Enum、list[X]、dict[str, X]、
+        dataclass和pydantic模型，嵌套的命名类型放在$defs中
+        """
+        compiler = SchemaCompiler()
+        return compiler.finish(compiler.compile(py_type))
     
     @staticmethod
     def function_to_schema(func, tool_name=None, description=None):
         """
         从Python函数自动生成OpenAI函数调用schema
+
+        结果按函数对象缓存，返回的schema被多处共享，调用方不要修改
         
         Args:
             func: Python函数对象
             tool_name: 工具名称，默认使用函数名
-            description: 工具描述，默认使用函数的docstring
+            description: 工具描述，默认使用函数docstring的摘要
         
         Returns:
             dict: OpenAI函数调用schema
         """
-        # 获取函数签名
-        sig = inspect.signature(func)
-        
-        # 获取类型提示
-        try:
-            type_hints = get_type_hints(func)
-        except:
-            type_hints = {}
-        
-        # 构建参数schema
-        properties = {}
-        required = []
-        
-        for param_name, param in sig.parameters.items():
-            # 跳过self参数
-            if param_name == 'self':
+        return _compile_function(func, tool_name, description)
+
+    @staticmethod
+    def mcp_tool_to_schema(tool):
+        """
+        从MCP工具定义生成OpenAI函数调用schema
+
+        参数结构取自服务端根据函数签名生成的inputSchema，参数说明和枚举取自
+        docstring的Args小节；工具描述只保留docstring摘要。
+        同一工具在inputSchema和描述不变时只生成一次
+
+        Args:
+            tool: MCP list_tools 返回的工具对象
+
+        Returns:
+            dict: OpenAI函数调用schema
+        """
+        input_schema = tool.inputSchema or {}
+        version = (tool.name, tool.description, json.dumps(input_schema, sort_keys=True))
+        schema = _tool_schema_cache.get(version)
+        if schema is not None:
+            return schema
+
+        summary, arg_docs = parse_docstring(tool.description)
+        parameters = _strip_titles(input_schema)
+        parameters.setdefault("type", "object")
+        parameters.setdefault("properties", {})
+        parameters.setdefault("required", [])
+        for name, prop in parameters["properties"].items():
+            doc = arg_docs.get(name)
+            if not doc:
                 continue
-                
-            # 获取参数类型
-            param_type = type_hints.get(param_name, str)
-            
-            # 转换为JSON Schema
-            param_schema = SchemaBuilder.python_type_to_json_schema(param_type)
-            
-            # 添加描述（从参数注释或默认描述）
-            param_schema["description"] = f"参数 {param_name}"
-            
-            properties[param_name] = param_schema
-            
-            # 判断是否为必需参数
-            if param.default is inspect.Parameter.empty:
-                required.append(param_name)
-        
-        # 构建完整的schema
-        schema = {
+            prop.setdefault("description", doc)
+            hint = _ENUM_HINT.search(doc)
+            if hint and prop.get("type") == "string" and "enum" not in prop:
+                prop["enum"] = hint.group(1).split("/")
+
+        schema = _tool_schema_cache[version] = {
             "type": "function",
             "function": {
-                "name": tool_name or func.__name__,
-                "description": description or func.__doc__ or f"函数 {func.__name__}",
-                "parameters": {
-                    "type": "object",
-                    "properties": properties,
-                    "required": required
-                }
+                "name": tool.name,
+                "description": summary or f"MCP tool: {tool.name}",
+                "parameters": parameters
             }
         }
-        
         return schema
 
 
@@ -113,6 +434,7 @@ class MCPSchemaGenerator:
     
     def __init__(self):
         self.tool_registry = {}
+        self._all_schemas = None
     
     def register_tool_function(self, tool_name: str, func, description: str = None):
         """注册工具函数"""
@@ -120,6 +442,7 @@ class MCPSchemaGenerator:
             'function': func,
             'description': description
         }
+        self._all_schemas = None
     
     def get_schema_for_tool(self, tool_name: str):
         """获取指定工具的schema"""
@@ -134,13 +457,15 @@ class MCPSchemaGenerator:
         )
     
     def get_all_schemas(self):
-        """获取所有已注册工具的schema"""
-        schemas = []
-        for tool_name in self.tool_registry:
-            schema = self.get_schema_for_tool(tool_name)
-            if schema:
-                schemas.append(schema)
-        return schemas
+        """获取所有已注册工具的schema，注册表不变时直接返回上次的结果"""
+        if self._all_schemas is None:
+            schemas = []
+            for tool_name in self.tool_registry:
+                schema = self.get_schema_for_tool(tool_name)
+                if schema:
+                    schemas.append(schema)
+            self._all_schemas = schemas
+        return self._all_schemas
 
 
 # 示例：定义一些工具函数
@@ -0,0 +1,194 @@
+"""
+本地Redis替身
+
+实现缓存后端用到的RESP2命令(PING/AUTH/SELECT/GET/MGET/SET [EX]/DEL)的内存服务，
+没有安装Redis时也可以用 CACHE_BACKEND=redis 在本机调试，或者检查 RedisBackend。
+
+用法:
+    python redis_standin.py                 # 在6379端口启动，配合 CACHE_REDIS_URL 使用
+    python redis_standin.py --port 16379
+    python redis_standin.py --check         # 启动替身并检查RedisBackend，失败时以非零状态码退出
+"""
+import argparse
+import asyncio
+import os
+import socketserver
+import sys
+import threading
+import time
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    """处理一个客户端连接，支持流水线(一次收到多条命令依次回复)"""
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            raise ValueError(f"只支持RESP数组格式的命令: {line!r}")
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def _bulk(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        while True:
+            try:
+                args = self._read_command()
+            except (ValueError, ConnectionError):
+                return
+            if args is None:
+                return
+            self.wfile.write(self.server.execute(args, self._bulk))
+
+
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    """
+    内存中的Redis替身
+
+    Args:
+        port: 监听端口，0表示随机端口
+        password: 设置后客户端需要先AUTH
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 6379, password: str = None):
+        super().__init__(("127.0.0.1", port), RESPHandler)
+        self.password = password
+        self.data = {}
+        self.commands = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}127.0.0.1:{self.server_address[1]}/0"
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, args, bulk) -> bytes:
+        command = args[0].upper()
+        with self._lock:
+            self.commands += 1
+            if command == b"PING":
+                return b"+PONG\r\n"
+            if command == b"AUTH":
+                if self.password and args[-1].decode() != self.password:
+                    return b"-WRONGPASS invalid password\r\n"
+                return b"+OK\r\n"
+            if command == b"SELECT":
+                if not args[1].isdigit() or int(args[1]) >= 16:
+                    return b"-ERR DB index is out of range\r\n"
+                return b"+OK\r\n"
+            if command == b"GET":
+                return bulk(self._get(args[1]))
+            if command == b"MGET":
+                return b"*%d\r\n" % (len(args) - 1) + b"".join(bulk(self._get(key)) for key in args[1:])
+            if command == b"SET":
+                expires_at = None
+                if len(args) >= 5 and args[3].upper() == b"EX":
+                    expires_at = time.monotonic() + int(args[4])
+                self.data[args[1]] = (args[2], expires_at)
+                return b"+OK\r\n"
+            if command == b"DEL":
+                return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args[1:])
+        return b"-ERR unknown command '" + command + b"'\r\n"
+
+    def start(self):
+        """在后台线程中运行"""
+        threading.Thread(target=self.serve_forever, name="redis-standin", daemon=True).start()
+        return self
+
+
+def check() -> list:
+    """
+    对替身运行RedisBackend的基本检查
+
+    Returns:
+        list: 失败项的说明，全部通过时为空
+    """
+    from tools.cache_backend import RedisBackend, RedisConnection, RedisError, cache_get, redis_breaker
+
+    failures = []
+
+    def expect(name, actual, expected):
+        if actual != expected:
+            failures.append(f"{name}: 期望 {expected!r}，实际 {actual!r}")
+
+    server = RedisStandIn(port=0, password="secret").start()
+    connection = RedisConnection(server.url)
+    cache = RedisBackend(connection, "check", ttl=60, max_stale=60)
+
+    cache.set_many({(1, "JSON"): [{"city": "北京市"}], (2, "JSON"): {"n": 2}})
+    before = server.commands
+    expect("MGET批量读取", cache.get_many([(1, "JSON"), (2, "JSON"), (3, "JSON")]),
+           {(1, "JSON"): [{"city": "北京市"}], (2, "JSON"): {"n": 2}})
+    expect("批量读取只发一条命令", server.commands - before, 1)
+
+    cache.set("expired", 1, ttl=-5)
+    expect("过期后get返回None", cache.get("expired"), None)
+    stale = cache.get_stale("expired", 100)
+    expect("过期数据可降级读取", stale is not None and stale[0], 1)
+    expect("异步读取", asyncio.run(cache_get(cache, (1, "JSON"))), [{"city": "北京市"}])
+
+    for name, url in (("错误密码", server.url.replace("secret", "wrong")), ("无效的数据库编号", server.url[:-1] + "99")):
+        try:
+            RedisConnection(url).execute(("PING",))
+            failures.append(f"{name}: 连接时没有报错")
+        except RedisError:
+            pass
+
+    connection.close()
+    server.shutdown()
+    server.server_close()
+    started = time.monotonic()
+    for _ in range(10):
+        expect("服务不可用时未命中", cache.get((1, "JSON")), None)
+    expect("断路器打开", redis_breaker.state, "open")
+    if time.monotonic() - started > 5:
+        failures.append("断路器打开后仍在等待连接超时")
+    return failures
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="本地Redis替身")
+    parser.add_argument("--port", type=int, default=6379, help="监听端口")
+    parser.add_argument("--password", default=None, help="要求客户端AUTH的密码")
+    parser.add_argument("--check", action="store_true", help="检查RedisBackend后退出")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.check:
+        # 检查时不需要持久化缓存文件
+        os.environ.setdefault("PERSISTENT_CACHE_PATH", "")
+        failures = check()
+        for failure in failures:
+            print(f"FAIL {failure}")
+        print("OK" if not failures else f"{len(failures)} 项检查失败")
+        sys.exit(1 if failures else 0)
+
+    server = RedisStandIn(port=args.port, password=args.password)
+    print(f"Redis替身运行在 {server.url}，Ctrl+C 停止")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
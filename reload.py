@@ -1,13 +1,13 @@
-import time 
-import logging 
+import logging
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from fnmatch import fnmatch
 from pathlib import Path
 import signal
 import sys
 import time
 import threading
-import os 
+import os
 
 # 配置日志
 logging.basicConfig(
@@ -20,38 +20,123 @@ logging.basicConfig(
 )
 logger = logging.getLogger("server.py")
 
-# 全局变量用于控制服务器
-server_running = True
-reload_requested = False
+# 只有这些后缀的文件变化才会触发重载
+WATCH_SUFFIXES = (".py",)
+
+# 忽略的路径模式(日志、虚拟环境、缓存目录等)
+IGNORE_PATTERNS = (
+    "*.log",
+    "*.pid",
+    "*/.venv/*",
+    "*/venv/*",
+    "*/__pycache__/*",
+    "*/.git/*",
+    "*/.pytest_cache/*",
+    "*/.mypy_cache/*",
+)
+
+# 最后一次变化之后静默多久才真正重载，期间的变化合并为一批
+DEBOUNCE_SECONDS = float(os.getenv("RELOAD_DEBOUNCE", "0.5"))
+
+# 关闭时等待服务器线程处理完存量请求的最长时间
+SHUTDOWN_TIMEOUT = float(os.getenv("RELOAD_SHUTDOWN_TIMEOUT", "10"))
+
+# 服务器线程异常退出后重启进程前的等待时间
+RESTART_DELAY = 5
+
+
+def should_ignore(path: str) -> bool:
+    """判断文件变化是否需要忽略"""
+    if not path.endswith(WATCH_SUFFIXES):
+        return True
+    return any(fnmatch(path, pattern) for pattern in IGNORE_PATTERNS)
+
+
+class ReloadSupervisor:
+    """
+    基于条件变量的重载监督器
+
+    文件监控线程和信号处理器只负责投递事件，主线程阻塞在条件变量上等待，
+    不再每秒轮询；同一防抖窗口内的多个文件变化会合并为一次重载。
+    """
+
+    def __init__(self, debounce: float = DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self._cond = threading.Condition()
+        self._changes = set()
+        self._last_change = 0.0
+        self._shutdown = False
+        self._server_exited = False
+
+    def notify_change(self, path: str):
+        """文件监控线程调用：记录一次文件变化"""
+        with self._cond:
+            self._changes.add(path)
+            self._last_change = time.monotonic()
+            self._cond.notify_all()
+
+    def notify_server_exit(self):
+        """服务器线程退出时调用"""
+        with self._cond:
+            self._server_exited = True
+            self._cond.notify_all()
+
+    def request_shutdown(self):
+        """信号处理器调用：请求关闭服务器"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    @property
+    def shutdown_requested(self) -> bool:
+        return self._shutdown
+
+    def wait(self):
+        """
+        阻塞直到需要处理的事件出现
+
+        Returns:
+            tuple: ("shutdown", set()) / ("exited", set()) / ("reload", 本批变化的文件)
+        """
+        with self._cond:
+            while True:
+                if self._shutdown:
+                    return "shutdown", set()
+                if self._server_exited:
+                    self._server_exited = False
+                    return "exited", set()
+                if self._changes:
+                    remaining = self._last_change + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        batch, self._changes = self._changes, set()
+                        return "reload", batch
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+
 
 # 热重载文件监控器
 class ReloadHandler(FileSystemEventHandler):
-    def __init__(self):
-        self.last_reload = time.time()
-        
-    def on_modified(self, event):
-        global reload_requested
-        if event.is_directory:
-            return
+    def __init__(self, supervisor: ReloadSupervisor):
+        self.supervisor = supervisor
 
-        # 只监控Python文件
-        if not event.src_path.endswith('.py'):
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ("modified", "created", "moved", "deleted"):
             return
-        
-        # 避免频繁重载
-        current_time = time.time()
-        if current_time - self.last_reload < 2:  # 2秒内不重复重载
+
+        # 移动事件以目标路径为准
+        path = getattr(event, "dest_path", "") or event.src_path
+        if should_ignore(path):
             return
 
-        self.last_reload = current_time
-        logger.info(f"检测到文件变化: {event.src_path}")
-        reload_requested = True
+        self.supervisor.notify_change(path)
+
 
-def setup_file_watcher():
+def setup_file_watcher(supervisor: ReloadSupervisor):
     """设置文件监控器"""
-    event_handler = ReloadHandler()
+    event_handler = ReloadHandler(supervisor)
     observer = Observer()
-    
+
     # 监控当前目录及子目录
     watch_path = Path(__file__).parent
     observer.schedule(event_handler, str(watch_path), recursive=True)
@@ -59,57 +144,110 @@ def setup_file_watcher():
     logger.info(f"文件监控器已启动，监控路径: {watch_path}")
     return observer
 
-def signal_handler(signum, frame):
-    """处理信号"""
-    global server_running
-    logger.info(f"接收到信号 {signum}，准备关闭服务器...")
-    server_running = False
-    sys.exit(0)
-
-def run_server_with_reload():
-    """带有热重载功能的服务器运行器"""
-    global server_running, reload_requested
-    
-    # 设置信号处理器
+
+def start_server_thread(supervisor: ReloadSupervisor, mcp, on_start=()):
+    """
+    在线程中启动MCP服务器
+
+    直接持有uvicorn.Server实例而不是调用mcp.run，这样关闭时可以设置
+    should_exit让服务器处理完存量请求后再退出。
+    FastMCP的会话管理器每个实例只能启动一次，所以每个进程只调用一次，
+    重载和异常退出后的重启都通过重新执行进程完成
+
+    Args:
+        mcp: server.py 中已经创建的FastMCP实例
+        on_start: 服务器线程启动后依次调用的函数，例如预热和依赖探测
+    """
+    import uvicorn
+
+    config = uvicorn.Config(
+        mcp.streamable_http_app(),
+        host=mcp.settings.host,
+        port=mcp.settings.port,
+        log_level=mcp.settings.log_level.lower(),
+        timeout_graceful_shutdown=int(SHUTDOWN_TIMEOUT),
+    )
+    server = uvicorn.Server(config)
+
+    def run():
+        try:
+            server.run()
+        except Exception as e:
+            logger.error(f"服务器运行错误: {e}")
+        finally:
+            supervisor.notify_server_exit()
+
+    server_thread = threading.Thread(target=run, name="mcp-server", daemon=True)
+    server_thread.start()
+    # 预热与服务器启动同时进行，完成之前 /health 报告未就绪
+    for func in on_start:
+        func()
+    return server, server_thread
+
+
+def stop_server(server, server_thread):
+    """通知服务器退出并等待线程处理完存量请求"""
+    server.should_exit = True
+    server_thread.join(SHUTDOWN_TIMEOUT)
+    if server_thread.is_alive():
+        logger.warning(f"服务器在 {SHUTDOWN_TIMEOUT} 秒内未退出，强制结束")
+
+
+def restart_process(observer):
+    """停止文件监控并重新执行当前进程，模块、FastMCP实例和缓存都重新创建"""
+    observer.stop()
+    observer.join()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+def run_server_with_reload(mcp, on_start=()):
+    """
+    带有热重载功能的服务器运行器
+
+    Args:
+        mcp: server.py 中已经创建的FastMCP实例，这里不再导入server，避免模块执行两次
+        on_start: 服务器启动后调用的函数
+    """
+    supervisor = ReloadSupervisor()
+
+    # 信号处理器只投递关闭事件，真正的清理在主线程完成
+    def signal_handler(signum, frame):
+        logger.info(f"接收到信号 {signum}，准备关闭服务器...")
+        supervisor.request_shutdown()
+
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
-    
+
     # 启动文件监控器
-    observer = setup_file_watcher()
-    
+    observer = setup_file_watcher(supervisor)
+
     try:
-        while server_running:
-            try:
-                logger.info("启动MCP服务器...")
-                logger.info(f"服务器运行在端口 8001")
-                logger.info("按 Ctrl+C 停止服务器")
-                
-                # 在新线程中运行服务器，以便可以检查重载请求
-                # 这里需要从server.py导入mcp实例
-                from server import mcp
-                server_thread = threading.Thread(
-                    target=lambda: mcp.run(transport="streamable-http"),
-                    daemon=True
-                )
-                server_thread.start()
-                
-                # 检查重载请求
-                while server_running and not reload_requested:
-                    time.sleep(1)
-                
-                if reload_requested:
-                    logger.info("检测到文件变化，正在重启服务器...")
-                    reload_requested = False
-                    # 这里我们使用进程重启的方式来实现热重载
-                    os.execv(sys.executable, [sys.executable] + sys.argv)
-                    
-            except KeyboardInterrupt:
-                logger.info("接收到键盘中断，停止服务器...")
-                break
-            except Exception as e:
-                logger.error(f"服务器运行错误: {e}")
-                time.sleep(5)  # 等待5秒后重试
-                
+        logger.info("启动MCP服务器...")
+        logger.info(f"服务器运行在端口 {mcp.settings.port}")
+        logger.info("按 Ctrl+C 停止服务器")
+
+        server, server_thread = start_server_thread(supervisor, mcp, on_start)
+        action, changes = supervisor.wait()
+
+        if action == "exited":
+            if supervisor.shutdown_requested:
+                return
+            # 同一个FastMCP实例不能再次启动，与热重载一样重新执行进程
+            logger.error(f"服务器线程意外退出，{RESTART_DELAY}秒后重启进程")
+            time.sleep(RESTART_DELAY)
+            if not supervisor.shutdown_requested:
+                restart_process(observer)
+            return
+
+        stop_server(server, server_thread)
+
+        if action == "reload":
+            logger.info(f"检测到 {len(changes)} 个文件变化，正在重启服务器...")
+            for path in sorted(changes):
+                logger.info(f"  变化文件: {path}")
+            # 这里我们使用进程重启的方式来实现热重载
+            restart_process(observer)
+
     finally:
         observer.stop()
         observer.join()
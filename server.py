@@ -1,12 +1,23 @@
 from mcp.server.fastmcp import FastMCP
-import requests
-from tools.city2code import adcode
+from mcp.server.fastmcp.exceptions import ToolError
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from tools.city2code import adcode, load_adcode_index, resolve_cities
+from tools.amap import amap_breaker, fetch_weather, forecast_ttl, latency_stats, warm_connection
+from tools.amap_keys import get_key_pool
+from tools.prefetch import DecayingCounter, Prefetcher
+from tools.cache_backend import make_cache
+from tools.weather_cache import TTLCache
+from tools.weather_models import LiveWeather, WeatherResult
+from warmup import WARMUP_CITIES, WARMUP_ENABLED, readiness
+from health_probes import PROBE_TIMEOUT, probes
+from metrics import metrics
+from starlette.responses import JSONResponse
 from dotenv import load_dotenv
+import asyncio
 import os
-import json
 import logging
-
-from reload import run_server_with_reload
+import threading
 
 # 配置日志
 logging.basicConfig(
@@ -26,47 +37,298 @@ load_dotenv()
 
 
 
-#目前只编写了实时天气获取
+# 实时天气缓存时间(秒)，高德实况数据大约每小时更新一次
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+# 后台提前刷新最热门的前N个城市的实时天气，设为0关闭
+LIVE_PREFETCH_TOP_N = int(os.getenv("LIVE_PREFETCH_TOP_N", "20"))
+# 后台刷新每分钟最多向高德发起的请求数
+LIVE_PREFETCH_BUDGET = int(os.getenv("LIVE_PREFETCH_BUDGET", "30"))
+# 批量查询时并发请求高德的最大线程数
+BATCH_MAX_WORKERS = int(os.getenv("WEATHER_BATCH_WORKERS", "4"))
+# 单次批量查询最多支持的城市数量
+BATCH_MAX_CITIES = 20
+
+# 高德不可用时允许返回的过期数据的最长过期时间(秒)
+STALE_MAX_AGE = float(os.getenv("WEATHER_STALE_MAX_AGE", "21600"))
+# 预报缓存的最大条目数，预报的过期时间按高德发布时刻计算
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "2048"))
+# 后台预取访问最多的前N个城市的预报，设为0关闭预取
+FORECAST_PREFETCH_TOP_N = int(os.getenv("FORECAST_PREFETCH_TOP_N", "20"))
+
+# 缓存后端由CACHE_BACKEND决定，多个worker可以共享sqlite或redis后端；
+# 进程内缓存之下有持久化层，重启后先从磁盘预热，不会所有请求同时打到高德
+weather_cache = make_cache("live", WEATHER_CACHE_TTL, persistent=True)
+forecast_cache = make_cache("forecast", 3600, maxsize=FORECAST_CACHE_SIZE, persistent=True)
+if isinstance(weather_cache, TTLCache) and weather_cache.store is not None:
+    logger.info(
+        f"从持久化缓存预热: 实时天气 {weather_cache.warm()} 条，预报 {forecast_cache.warm()} 条"
+    )
+# 访问热度按半衰期衰减，实况关注最近半小时，预报关注最近半天
+live_counter = DecayingCounter(half_life=1800)
+forecast_counter = DecayingCounter(half_life=6 * 3600)
+
+
+def refresh_live(key):
+    '''请求高德实时天气并写入实时天气缓存'''
+    code, output = key
+    data = fetch_weather(code, "base", output)
+    if data is not None:
+        weather_cache.set(key, data)
+    return data
+
+
+# 每15秒检查一次，在缓存过期前30秒刷新热门城市，每轮预算为每分钟预算的1/4
+live_prefetcher = Prefetcher(
+    "live",
+    weather_cache,
+    live_counter,
+    refresh_live,
+    top_n=LIVE_PREFETCH_TOP_N,
+    lead=30,
+    interval=15,
+    budget=max(1, LIVE_PREFETCH_BUDGET // 4),
+)
+
+
+def refresh_forecast(key):
+    '''请求高德预报数据并写入预报缓存'''
+    code, output = key
+    data = fetch_weather(code, "all", output)
+    if data is not None:
+        forecast_cache.set(key, data, ttl=forecast_ttl())
+    return data
+
+
+# 缓存在发布时刻+发布延迟时过期，提前lead秒刷新时新预报已经发布
+forecast_prefetcher = Prefetcher(
+    "forecast",
+    forecast_cache,
+    forecast_counter,
+    refresh_forecast,
+    top_n=FORECAST_PREFETCH_TOP_N,
+    lead=120,
+    interval=60,
+)
+
+
+def stale_fallback(cache, key):
+    '''
+    上游请求失败时读取过期缓存，每条记录加上stale标记
+
+    Returns:
+        list: 带stale标记的天气数据，没有可用旧数据时返回None
+    '''
+    item = cache.get_stale(key, STALE_MAX_AGE)
+    if item is None:
+        return None
+    data, stale_for = item
+    logger.warning(f"高德请求失败，返回过期 {stale_for:.0f} 秒的缓存数据 {key}")
+    return [dict(record, stale=True) for record in data]
+
+
+def get_forecast(code, output: str = "JSON"):
+    '''按adcode获取预报数据，优先读取预报缓存'''
+    key = (code, output)
+    forecast_counter.hit(key)
+    forecast_prefetcher.ensure_started()
+
+    data = forecast_cache.get(key)
+    if data is None:
+        data = refresh_forecast(key)
+    if data is None:
+        data = stale_fallback(forecast_cache, key)
+    return data
+
+
+def get_weather(code, extensions: str = "base", output: str = "JSON"):
+    '''
+    按adcode获取天气数据，实时天气和预报分别读取各自的缓存
+
+    Returns:
+        list: 天气数据，失败返回None
+    '''
+    if extensions == "all":
+        return get_forecast(code, output)
+
+    key = (code, output)
+    live_counter.hit(key)
+    live_prefetcher.ensure_started()
+
+    data = weather_cache.get(key)
+    if data is None:
+        data = refresh_live(key)
+    if data is None:
+        data = stale_fallback(weather_cache, key)
+    return data
+
+
+def query_weather(city:str, extensions:str="base")->WeatherResult:
+    '''weather工具的同步实现，会阻塞在高德请求和等待key令牌上'''
+    # 直接调用MCP的客户端不经过本地参数校验，不合法的值会变成高德的错误码并污染缓存键
+    extensions = (extensions or "base").strip().lower()
+    if extensions not in ("base", "all"):
+        raise ToolError(f"extensions 只能是 base 或 all，收到: {extensions}")
+    code = adcode(city)
+    weather_data = get_weather(code, extensions, "JSON")
+    if weather_data is None:
+        raise ToolError(f"未能获取 {city} 的天气数据，请稍后重试")
+    field = "forecasts" if extensions == "all" else "lives"
+    return WeatherResult(query=city, adcode=code, extensions=extensions, **{field: weather_data})
+
+
+#实时天气(base)和天气预报(all)分别走各自的缓存
+#FastMCP在事件循环上直接调用同步工具，阻塞的查询放到线程里执行，不拖慢其他MCP请求
 @mcp.tool()
-def weather(city:str, extensions:str="base", output:str="JSON")->str:
+async def weather(city:str, extensions:str="base")->WeatherResult:
     '''
     获取天气信息
 
     Args:
-        city: 城市编码 adcode格式(必填)
+        city: 城市名或adcode(必填)，例如 北京市、深圳市、东城区、440300
         extensions: 气象类型,可选值:base/all(可选,默认base)
-        output: 返回格式,可选值:JSON/XML(可选,默认JSON)
 
     Returns:
-        str: 天气信息或错误信息
+        WeatherResult: 结构化的天气信息，获取失败时返回错误结果(isError)
 
 '''
-    result = []
-    base_url = "https://restapi.amap.com/v3/weather/weatherInfo"
-    code = adcode(city)
-    params = {
-        
-        "key": os.getenv("KEY"),
-        "city": code,
-        "extensions": extensions,
-        "output": output
+    return await asyncio.to_thread(query_weather, city, extensions)
+
+
+@mcp.tool()
+async def weather_batch(cities:list[str])->dict[str, Optional[LiveWeather]]:
+    '''
+    批量获取多个城市的实时天气
+
+    Args:
+        cities: 城市名或adcode列表(必填)，最多20个
+
+    Returns:
+        dict: 以城市名为键的实况天气，查询失败的城市值为null
+    '''
+    return await asyncio.to_thread(query_weather_batch, cities)
+
+
+def query_weather_batch(cities:list[str])->dict[str, Optional[LiveWeather]]:
+    '''weather_batch工具的同步实现'''
+    cities = list(dict.fromkeys(cities))[:BATCH_MAX_CITIES]
+    codes = resolve_cities(cities)
+
+    # 先批量读缓存(共享后端一次往返)，只有未命中的adcode才访问高德
+    live_prefetcher.ensure_started()
+    keys = [(code, "JSON") for code in set(codes.values()) if code is not None]
+    for key in keys:
+        live_counter.hit(key)
+    found = {key[0]: data for key, data in weather_cache.get_many(keys).items()}
+    missing = {key[0] for key in keys if key[0] not in found}
+
+    if missing:
+        logger.info(f"批量查询: 缓存命中 {len(found)} 个，需请求 {len(missing)} 个")
+        missing = list(missing)
+        keys = [(code, "JSON") for code in missing]
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(missing))) as pool:
+            for key, data in zip(keys, pool.map(refresh_live, keys)):
+                if data is None:
+                    data = stale_fallback(weather_cache, key)
+                if data is not None:
+                    found[key[0]] = data
+
+    result = {}
+    for city, code in codes.items():
+        data = found.get(code)
+        result[city] = LiveWeather.model_validate(data[0]) if data else None
+    return result
+
+
+def warm_weather(cities):
+    '''预先查询热门城市的实时天气，已经从持久化缓存预热的城市不再请求高德'''
+    codes = {code for code in resolve_cities(cities).values() if code is not None}
+    keys = [(code, "JSON") for code in codes]
+    cached = weather_cache.get_many(keys)
+    missing = [key for key in keys if key not in cached]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(missing))) as pool:
+            fetched = sum(data is not None for data in pool.map(refresh_live, missing))
+    else:
+        fetched = 0
+    return {"cached": len(cached), "fetched": fetched, "failed": len(missing) - fetched}
+
+
+def warm_up():
+    '''依次执行预热步骤，结束后标记就绪'''
+    readiness.run_step("adcode_index", lambda: len(load_adcode_index()))
+    readiness.run_step("amap_connection", warm_connection)
+    if WARMUP_CITIES:
+        readiness.run_step("weather", lambda: warm_weather(WARMUP_CITIES))
+    readiness.mark_ready()
+
+
+_warmup_started = threading.Lock()
+
+
+def start_warmup():
+    '''在后台线程中预热，服务器可以同时启动并通过 /health 报告未就绪'''
+    if not WARMUP_ENABLED or not _warmup_started.acquire(blocking=False):
+        return
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+
+# 高德是所有实例共用的上游，故障时各实例仍可返回过期缓存，所以默认只报告、不影响就绪，
+# 否则高德故障会让负载均衡摘除全部实例；需要时可通过PROBE_REQUIRED=amap改为影响就绪
+@probes.probe("amap", optional=True)
+def probe_amap():
+    '''高德接口：断路器打开或没有可用key时直接失败，否则发送不带key的HEAD请求'''
+    if amap_breaker.state == "open":
+        raise RuntimeError("高德断路器已打开")
+    key_pool = get_key_pool()
+    if not key_pool.usable():
+        raise RuntimeError("没有可用的高德key")
+    return {
+        "http_status": warm_connection(timeout=PROBE_TIMEOUT),
+        "breaker": amap_breaker.state,
+        "latency": latency_stats(),
+        "keys": key_pool.snapshot(),
     }
 
-    
-    #调试
-    logger.info(f"正在获取天气数据--------")
-    
-    try:
-        #尝试访问API
-        response = requests.get(base_url, params=params, timeout=10) 
-        if response.status_code ==200:
-            api_response = response.json()
-            #检查API响应情况
-            if api_response.get("status") == "1":
-                weather_data = api_response.get("lives")
-                return json.dumps(weather_data,ensure_ascii=False)
-    except Exception as e:
-        logger.error(f"访问API出现错误:{e}")
+
+_probes_started = threading.Lock()
+
+
+def start_probes():
+    '''在后台线程中定期探测依赖，/readyz 只读取缓存的结果'''
+    if _probes_started.acquire(blocking=False):
+        probes.start_thread()
+
+
+@mcp.custom_route("/health", methods=["GET"])
+async def health(request):
+    '''健康检查：进程存活即返回live，预热完成之前返回503'''
+    state = readiness.snapshot()
+    body = {"status": "ok" if state["ready"] else "warming", "live": True, **state}
+    return JSONResponse(body, status_code=200 if state["ready"] else 503)
+
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def get_metrics(request):
+    '''进程内指标，包括每个高德key的状态和高德请求耗时'''
+    return JSONResponse({
+        **metrics.snapshot(),
+        "amap_keys": get_key_pool().snapshot(),
+        "amap_latency": latency_stats(),
+    })
+
+
+@mcp.custom_route("/livez", methods=["GET"])
+async def livez(request):
+    '''存活探测：能处理请求即返回200，不检查任何依赖'''
+    return JSONResponse({"status": "ok"})
+
+
+@mcp.custom_route("/readyz", methods=["GET"])
+async def readyz(request):
+    '''就绪探测：预热完成且依赖探测都正常时返回200，否则503'''
+    state = probes.snapshot()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
 
     
 
@@ -76,4 +338,6 @@ if __name__ == "__main__":
     logger.info("支持热重载和后台运行")
     logger.info("="*50)
     
-    run_server_with_reload()
+    # watchdog只有热重载需要，被导入(如reload.py、基准测试)时不加载
+    from reload import run_server_with_reload
+    run_server_with_reload(mcp, on_start=(start_warmup, start_probes))
@@ -28,12 +28,18 @@ if [ ! -f ".env" ]; then
 fi
 
 
+# worker数量，默认1，可通过CHAT_WORKERS环境变量覆盖；
+# 进行中的回答保存在各worker的内存中，多worker共用端口时网页界面和断线续传都会失败，
+# chat_server.py 会拒绝启动，除非设置 CHAT_ALLOW_SHARED_WORKERS=1(客户端只使用单次请求的接口)
+WORKERS=${CHAT_WORKERS:-1}
+
 echo ""
-echo "启动MCP聊天服务器..."
-echo "服务器地址: http://localhost:8002"
-echo "按 Ctrl+C 停止服务器"
+echo "启动MCP聊天服务器(生产模式，$WORKERS 个worker)..."
+echo "服务器地址: http://localhost:${CHAT_PORT:-8002}"
+echo "停止服务器: kill \$(cat chat.pid)  (SIGTERM会等待进行中的回答完成)"
 echo ""
 
-# 启动服务器
-nohup python3 chat_server.py > chat.log 2>&1 &
-echo "日志文件存放于chat.log"
+# 启动服务器；开发时可直接运行 python3 chat_server.py 使用热重载
+nohup python3 chat_server.py --prod --workers "$WORKERS" > chat.log 2>&1 &
+echo $! > chat.pid
+echo "日志文件存放于chat.log，进程ID已写入chat.pid"
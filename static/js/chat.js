@@ -112,7 +112,7 @@ class ChatClient {
         return div.innerHTML;
     }
 
-    async sendMessage() {
+    sendMessage() {
         if (this.isGenerating) return;
         
         const message = this.chatInput.value.trim();
@@ -130,80 +130,74 @@ class ChatClient {
         // 添加打字指示器
         const typingIndicator = this.addTypingIndicator();
 
-        try {
-            const response = await fetch('/chat/stream', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ message: message })
+        // 先用POST开始生成，消息不放在URL里；再用EventSource订阅回答，
+        // 订阅地址只续传，断线时EventSource带上Last-Event-ID重连不会重新生成
+        fetch('/chat/sse/start', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({message})
+        })
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.json();
+            })
+            .then(({events_url}) => this.subscribe(events_url, typingIndicator))
+            .catch(error => {
+                typingIndicator.remove();
+                this.addAssistantMessage().textContent = '❌ 连接错误: ' + error.message;
+                this.isGenerating = false;
+                this.sendButton.disabled = false;
+                this.chatInput.disabled = false;
+                this.chatInput.focus();
             });
+    }
+
+    subscribe(eventsUrl, typingIndicator) {
+        const source = new EventSource(eventsUrl);
+        let assistantContent = null;
+
+        const finish = () => {
+            source.close();
+            // 重新启用输入
+            this.isGenerating = false;
+            this.sendButton.disabled = false;
+            this.chatInput.disabled = false;
+            this.chatInput.focus();
+        };
 
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+        source.onmessage = (event) => {
+            if (!assistantContent) {
+                // 移除打字指示器，创建助手消息容器
+                typingIndicator.remove();
+                assistantContent = this.addAssistantMessage();
             }
 
-            // 移除打字指示器
-            typingIndicator.remove();
-
-            // 创建助手消息容器
-            const assistantContent = this.addAssistantMessage();
-
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-
-            let buffer = '';
-            
-            while (true) {
-                const { value, done } = await reader.read();
-                if (done) break;
-
-                const chunk = decoder.decode(value, { stream: true });
-                buffer += chunk;
-                
-                // 处理完整的行
-                const lines = buffer.split('\n');
-                buffer = lines.pop() || ''; // 保留最后不完整的行
-
-                for (const line of lines) {
-                    if (line.trim()) {
-                        try {
-                            const data = JSON.parse(line);
-                            this.handleStreamData(data, assistantContent);
-                        } catch (e) {
-                            console.error('解析JSON失败:', e);
-                            console.error('原始数据:', line);
-                            console.error('数据长度:', line.length);
-                        }
-                    }
-                }
+            let data;
+            try {
+                data = JSON.parse(event.data);
+            } catch (e) {
+                console.error('解析JSON失败:', e);
+                console.error('原始数据:', event.data);
+                return;
             }
-            
-            // 处理缓冲区中剩余的数据
-            if (buffer.trim()) {
-                try {
-                    const data = JSON.parse(buffer);
-                    this.handleStreamData(data, assistantContent);
-                } catch (e) {
-                    console.error('处理最后数据失败:', e, '数据:', buffer);
-                }
+
+            this.handleStreamData(data, assistantContent);
+            if (data.type === 'end' || data.type === 'error') {
+                finish();
             }
+        };
+
+        source.onerror = () => {
+            // 连接中断时EventSource会自动重连，只有被关闭时才算失败
+            if (source.readyState !== EventSource.CLOSED) return;
 
-        } catch (error) {
-            // 移除打字指示器
             if (typingIndicator && typingIndicator.parentNode) {
                 typingIndicator.remove();
             }
-            
-            const errorContent = this.addAssistantMessage();
-            errorContent.textContent = `❌ 连接错误: ${error.message}`;
-        } finally {
-            // 重新启用输入
-            this.isGenerating = false;
-            this.sendButton.disabled = false;
-            this.chatInput.disabled = false;
-            this.chatInput.focus();
-        }
+            const errorContent = assistantContent || this.addAssistantMessage();
+            errorContent.textContent += '❌ 连接错误: 无法继续接收回答';
+            finish();
+        };
     }
 
     handleStreamData(data, assistantContent) {
@@ -0,0 +1,192 @@
+"""
+聊天流事件编码器
+
+StreamingChatAgent 产出事件字典，这里负责把事件编码为各传输方式的字节帧：
+NDJSON(chat/stream)、SSE(chat/sse)和WebSocket(chat/ws)。事件的JSON字段
+与原来的 json.dumps 输出一致，相邻的 content 增量会合并成一帧再写出，
+减少每个token的序列化开销和写出次数。
+"""
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator
+
+try:
+    import orjson
+except ImportError:  # orjson是可选依赖
+    orjson = None
+
+# content帧的最长攒批时间(秒)和最大字符数，超过任一阈值就写出
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.03"))
+STREAM_FLUSH_SIZE = int(os.getenv("STREAM_FLUSH_SIZE", "256"))
+
+# 预编码的content事件模板，热路径上只需要编码文本本身
+_CONTENT_PREFIX = b'{"type":"content","content":'
+_CONTENT_END = b"}"
+
+
+def dumps(obj) -> bytes:
+    """序列化为UTF-8 JSON字节，中文不转义"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_content(text: str) -> bytes:
+    """编码一个content事件的JSON"""
+    return _CONTENT_PREFIX + dumps(text) + _CONTENT_END
+
+
+def encode_event(event: dict) -> bytes:
+    """编码任意事件的JSON"""
+    if event.get("type") == "content" and len(event) == 2:
+        return encode_content(event["content"])
+    return dumps(event)
+
+
+async def _enumerate(events: AsyncIterator[dict]):
+    seq = 0
+    async for event in events:
+        yield seq, event
+        seq += 1
+
+
+class StreamEncoder:
+    """
+    编码器基类：合并相邻的content增量，由子类决定每一帧的外层格式
+
+    事件以 (序号, 事件) 的形式输入，合并后的帧使用其中最后一个事件的序号，
+    客户端从该序号之后续传不会丢失也不会重复内容。
+    攒下的content最多等待flush_interval秒：期间没有新事件到达(例如模型停顿)
+    也会按时写出；遇到非content事件或流结束时立即写出。
+
+    Args:
+        flush_interval: content帧的最长攒批时间(秒)，0表示不合并
+        flush_size: content帧攒够多少字符后写出
+    """
+
+    def __init__(self, flush_interval: float = STREAM_FLUSH_INTERVAL, flush_size: int = STREAM_FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+    def frame(self, seq: int, payload: bytes) -> bytes:
+        """把一个事件的JSON包装成传输帧"""
+        raise NotImplementedError
+
+    async def encode(self, events: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+        """编码没有序号的事件流，序号从0开始自动编号"""
+        async for frame in self.encode_indexed(_enumerate(events)):
+            yield frame
+
+    async def encode_indexed(self, events) -> AsyncIterator[bytes]:
+        """编码 (序号, 事件) 流"""
+        pending = []
+        pending_size = 0
+        pending_seq = 0
+        first_at = 0.0
+        iterator = events.__aiter__()
+        # 有攒下的content时，下一个事件放在任务里等待，超时先写出已有内容；
+        # 超时不取消这个任务，写出后继续等待同一个事件
+        next_event = None
+
+        try:
+            while True:
+                if pending:
+                    if next_event is None:
+                        next_event = asyncio.ensure_future(iterator.__anext__())
+                    remaining = self.flush_interval - (time.monotonic() - first_at)
+                    done, _ = await asyncio.wait({next_event}, timeout=max(0.0, remaining))
+                    if not done:
+                        yield self.frame(pending_seq, encode_content("".join(pending)))
+                        pending = []
+                        pending_size = 0
+                        continue
+                try:
+                    if next_event is not None:
+                        seq, event = await next_event
+                    else:
+                        seq, event = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_event = None
+
+                if event.get("type") == "content":
+                    text = event["content"]
+                    if not pending:
+                        first_at = time.monotonic()
+                    pending.append(text)
+                    pending_size += len(text)
+                    pending_seq = seq
+                    if pending_size >= self.flush_size or time.monotonic() - first_at >= self.flush_interval:
+                        yield self.frame(pending_seq, encode_content("".join(pending)))
+                        pending = []
+                        pending_size = 0
+                    continue
+
+                # 非content事件和之前攒下的content一起写出
+                frame = self.frame(seq, encode_event(event))
+                if pending:
+                    frame = self.frame(pending_seq, encode_content("".join(pending))) + frame
+                    pending = []
+                    pending_size = 0
+                yield frame
+        finally:
+            # 客户端提前断开时不再等待下一个事件
+            if next_event is not None:
+                next_event.cancel()
+
+        if pending:
+            yield self.frame(pending_seq, encode_content("".join(pending)))
+
+
+class NDJSONStreamEncoder(StreamEncoder):
+    """
+    每行一个JSON对象，chat/stream 使用
+
+    Args:
+        with_seq: 为True时每行带上seq字段，客户端断线后可以据此续传
+    """
+
+    def __init__(self, with_seq: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.with_seq = with_seq
+
+    def frame(self, seq: int, payload: bytes) -> bytes:
+        if self.with_seq:
+            # 把 {"type":...} 拼接成 {"seq":n,"type":...}
+            return b'{"seq":' + str(seq).encode() + b"," + payload[1:] + b"\n"
+        return payload + b"\n"
+
+
+class SSEStreamEncoder(StreamEncoder):
+    """
+    text/event-stream 格式，事件ID为 "响应ID:序号"
+
+    浏览器重连时会在 Last-Event-ID 请求头里带上最后收到的事件ID
+    """
+
+    def __init__(self, response_id: str, **kwargs):
+        super().__init__(**kwargs)
+        self._id_prefix = b"id: " + response_id.encode() + b":"
+
+    def frame(self, seq: int, payload: bytes) -> bytes:
+        return self._id_prefix + str(seq).encode() + b"\ndata: " + payload + b"\n\n"
+
+
+class WebSocketStreamEncoder(StreamEncoder):
+    """
+    WebSocket文本帧，每个事件带上会话ID、响应ID和序号，供一条连接上的多个会话区分
+
+    合并时多个帧会拼在一起，所以这里每帧以换行结尾，客户端按行拆分
+    """
+
+    def __init__(self, conversation_id: str, response_id: str, **kwargs):
+        super().__init__(**kwargs)
+        header = dumps({"conversation_id": conversation_id, "response_id": response_id})
+        self._header = header[:-1] + b',"seq":'
+
+    def frame(self, seq: int, payload: bytes) -> bytes:
+        # 把 {"type":...} 拼接成 {"conversation_id":...,"seq":n,"type":...}
+        return self._header + str(seq).encode() + b"," + payload[1:] + b"\n"
@@ -0,0 +1,207 @@
+"""
+聊天流注册表
+
+每次回答由一个后台任务驱动事件生产者，生成过程与HTTP连接解耦：客户端断开后
+回答继续生成，产生的事件记录在有上限的重放缓冲区中。NDJSON、SSE、WebSocket
+等传输方式都只是订阅者，重连的客户端可以从最后收到的序号之后继续读取。
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 回答结束后仍保留多久(秒)，期间断线的客户端可以续传
+STREAM_LINGER_SECONDS = float(os.getenv("STREAM_LINGER_SECONDS", "60"))
+# 每个回答的重放缓冲区最多保留的事件数，超出后丢弃最早的事件
+STREAM_REPLAY_MAX_EVENTS = int(os.getenv("STREAM_REPLAY_MAX_EVENTS", "2000"))
+# 所有客户端都断开后等待多久(秒)，期间没有客户端重连就取消生成
+STREAM_ORPHAN_GRACE_SECONDS = float(os.getenv("STREAM_ORPHAN_GRACE_SECONDS", "15"))
+# 最多同时保留的回答数量，超出时优先淘汰最早结束的回答
+STREAM_HUB_MAX_STREAMS = int(os.getenv("STREAM_HUB_MAX_STREAMS", "1000"))
+
+
+class ChatStream:
+    """
+    一次回答的事件记录
+
+    事件序号从0开始连续递增，缓冲区只保留最近max_events个事件，
+    base_seq 是缓冲区中最早事件的序号。
+    创建后还没有订阅者、或最后一个订阅者断开后，如果orphan_grace秒内没有订阅者连接，
+    就取消生成任务，取消会沿着事件生产者传递到OpenAI流和MCP工具调用
+    """
+
+    def __init__(
+        self,
+        response_id: str,
+        max_events: int = STREAM_REPLAY_MAX_EVENTS,
+        orphan_grace: float = STREAM_ORPHAN_GRACE_SECONDS,
+    ):
+        self.response_id = response_id
+        self.events = deque(maxlen=max_events)
+        self.base_seq = 0
+        self.done = False
+        self.cancelled = False
+        # 生成被取消时发给客户端的错误信息
+        self.cancel_message = "客户端已断开，回答已取消"
+        self.task = None
+        self.subscribers = 0
+        self.orphan_grace = orphan_grace
+        self._orphan_timer = None
+        self._cond = asyncio.Condition()
+
+    @property
+    def next_seq(self) -> int:
+        return self.base_seq + len(self.events)
+
+    def can_resume(self, offset: int) -> bool:
+        return self.base_seq <= offset <= self.next_seq
+
+    async def publish(self, event: dict):
+        if len(self.events) == self.events.maxlen:
+            self.base_seq += 1
+        self.events.append(event)
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def close(self):
+        self.done = True
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+        async with self._cond:
+            self._cond.notify_all()
+
+    def _attach(self):
+        self.subscribers += 1
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+
+    def _detach(self):
+        self.subscribers -= 1
+        if self.subscribers > 0 or self.done:
+            return
+        metrics.inc("chat_client_disconnects")
+        self._arm_orphan_timer()
+
+    def _arm_orphan_timer(self):
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+        self._orphan_timer = asyncio.get_running_loop().call_later(
+            self.orphan_grace, self._cancel_orphan
+        )
+
+    def _cancel_orphan(self):
+        self._orphan_timer = None
+        if self.subscribers > 0 or self.done or self.task is None:
+            return
+        logger.info(f"回答 {self.response_id} 在 {self.orphan_grace} 秒内没有客户端订阅，取消生成")
+        self.cancelled = True
+        self.task.cancel()
+
+    async def subscribe(self, offset: int = 0):
+        """
+        从指定序号开始读取事件，追上之后等待新事件，回答结束时退出
+
+        订阅者落后太多、需要的事件已被丢弃时，输出一个error事件后退出
+
+        Yields:
+            tuple: (序号, 事件)
+        """
+        self._attach()
+        try:
+            while True:
+                while offset < self.next_seq:
+                    if offset < self.base_seq:
+                        yield offset, {"type": "error", "error": "续传位置已过期，请重新提问"}
+                        return
+                    yield offset, self.events[offset - self.base_seq]
+                    offset += 1
+                if self.done:
+                    return
+                async with self._cond:
+                    await self._cond.wait_for(lambda: self.done or offset < self.next_seq)
+        finally:
+            self._detach()
+
+
+class StreamHub:
+    """按响应ID管理正在生成和刚结束的回答"""
+
+    def __init__(self, linger: float = STREAM_LINGER_SECONDS, max_streams: int = STREAM_HUB_MAX_STREAMS):
+        self.linger = linger
+        self.max_streams = max_streams
+        self._streams = OrderedDict()
+
+    def start(self, producer: AsyncIterator[dict]) -> ChatStream:
+        """创建回答并在后台任务中驱动事件生产者，生成不依赖于任何客户端连接"""
+        self._evict()
+        stream = ChatStream(uuid.uuid4().hex)
+        self._streams[stream.response_id] = stream
+        # 持有任务引用，避免生成中的任务被垃圾回收
+        stream.task = asyncio.create_task(self._pump(stream, producer))
+        # 客户端拿到响应ID后没有来订阅(或在订阅前就断开)时，同样在宽限期后取消生成
+        stream._arm_orphan_timer()
+        return stream
+
+    def get(self, response_id: str) -> Optional[ChatStream]:
+        return self._streams.get(response_id)
+
+    @property
+    def active(self) -> int:
+        """正在生成的回答数量"""
+        return sum(1 for stream in self._streams.values() if not stream.done)
+
+    async def drain(self, timeout: float):
+        """
+        关闭前等待正在生成的回答完成，超时后取消剩余的回答
+
+        Args:
+            timeout: 最长等待时间(秒)
+        """
+        streams = {stream.task: stream for stream in self._streams.values() if not stream.done and stream.task}
+        if not streams:
+            return
+        logger.info(f"等待 {len(streams)} 个正在生成的回答完成，最多 {timeout} 秒")
+        _, pending = await asyncio.wait(streams, timeout=timeout)
+        for task in pending:
+            streams[task].cancel_message = "服务器正在重启，回答已中断，请重新提问"
+            task.cancel()
+        if pending:
+            logger.warning(f"{len(pending)} 个回答未能在 {timeout} 秒内完成，已取消")
+            await asyncio.wait(pending)
+
+    def _evict(self):
+        """回答数量达到上限时，按创建顺序淘汰已经结束的回答"""
+        if len(self._streams) < self.max_streams:
+            return
+        for response_id in [rid for rid, stream in self._streams.items() if stream.done]:
+            del self._streams[response_id]
+            if len(self._streams) < self.max_streams:
+                return
+        logger.warning(f"正在生成的回答数量已达 {len(self._streams)}，超过上限 {self.max_streams}")
+
+    async def _pump(self, stream: ChatStream, producer: AsyncIterator[dict]):
+        metrics.inc("chat_streams_started")
+        try:
+            async for event in producer:
+                await stream.publish(event)
+            metrics.inc("chat_streams_completed")
+        except asyncio.CancelledError:
+            metrics.inc("chat_streams_cancelled")
+            await stream.publish({"type": "error", "error": stream.cancel_message})
+        except Exception as e:
+            metrics.inc("chat_streams_failed")
+            logger.error(f"回答 {stream.response_id} 生成失败: {e}")
+            await stream.publish({"type": "error", "error": f"处理过程中出现错误: {e}"})
+        finally:
+            await stream.close()
+            asyncio.get_running_loop().call_later(
+                self.linger, self._streams.pop, stream.response_id, None
+            )
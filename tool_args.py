@@ -0,0 +1,202 @@
+"""
+工具调用参数校验
+
+把OpenAI工具schema中的JSON Schema预先编译成校验函数，在调用MCP工具之前
+在本地检查并修复模型生成的参数(数字字符串转数字、枚举大小写、补默认值、
+去掉未声明的参数等)，无法修复时直接返回错误，省掉一次MCP往返。
+"""
+import copy
+import json
+from typing import Any, Callable
+
+
+class ToolArgumentError(ValueError):
+    """工具参数不合法且无法自动修复"""
+
+
+_TRUE_STRINGS = {"true", "1", "yes"}
+_FALSE_STRINGS = {"false", "0", "no"}
+
+
+def _compile_string(schema):
+    def check(value, path):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        raise ToolArgumentError(f"{path} 应为字符串")
+    return check
+
+
+def _compile_integer(schema):
+    def check(value, path):
+        if isinstance(value, bool):
+            raise ToolArgumentError(f"{path} 应为整数")
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str):
+            try:
+                return int(value.strip())
+            except ValueError:
+                pass
+        raise ToolArgumentError(f"{path} 应为整数")
+    return check
+
+
+def _compile_number(schema):
+    def check(value, path):
+        if isinstance(value, bool):
+            raise ToolArgumentError(f"{path} 应为数字")
+        if isinstance(value, (int, float)):
+            return value
+        if isinstance(value, str):
+            try:
+                return float(value.strip())
+            except ValueError:
+                pass
+        raise ToolArgumentError(f"{path} 应为数字")
+    return check
+
+
+def _compile_boolean(schema):
+    def check(value, path):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in _TRUE_STRINGS | _FALSE_STRINGS:
+            return value.strip().lower() in _TRUE_STRINGS
+        raise ToolArgumentError(f"{path} 应为布尔值")
+    return check
+
+
+def _compile_array(schema):
+    check_item = compile_schema(schema.get("items", {}))
+
+    def check(value, path):
+        # 模型经常把只有一个元素的数组写成单个值
+        if not isinstance(value, list):
+            value = [value]
+        return [check_item(item, f"{path}[{i}]") for i, item in enumerate(value)]
+    return check
+
+
+def _compile_object(schema):
+    properties = {
+        name: compile_schema(prop) for name, prop in schema.get("properties", {}).items()
+    }
+    defaults = {
+        name: prop["default"]
+        for name, prop in schema.get("properties", {}).items()
+        if "default" in prop
+    }
+    required = tuple(schema.get("required", ()))
+    # 没有声明任何属性时原样放行，否则只保留声明过的参数
+    allow_extra = not properties or schema.get("additionalProperties") is True
+
+    def check(value, path):
+        if not isinstance(value, dict):
+            raise ToolArgumentError(f"{path} 应为对象")
+        missing = [name for name in required if name not in value and name not in defaults]
+        if missing:
+            raise ToolArgumentError(f"{path} 缺少必填参数: {', '.join(missing)}")
+        result = {}
+        for name, item in value.items():
+            if name in properties:
+                result[name] = properties[name](item, f"{path}.{name}")
+            elif allow_extra:
+                result[name] = item
+            # 未声明的参数直接丢弃
+        # 缺少的参数(必填或可选)有默认值时补上，默认值复制一份，避免调用之间共享可变对象
+        for name, default in defaults.items():
+            if name not in result:
+                result[name] = copy.deepcopy(default)
+        return result
+    return check
+
+
+_COMPILERS = {
+    "string": _compile_string,
+    "integer": _compile_integer,
+    "number": _compile_number,
+    "boolean": _compile_boolean,
+    "array": _compile_array,
+    "object": _compile_object,
+}
+
+
+def _with_enum(check, enum):
+    """类型检查之后再检查枚举，字符串忽略大小写和首尾空白进行修复"""
+    folded = {str(option).strip().lower(): option for option in enum}
+
+    def check_enum(value, path):
+        value = check(value, path)
+        if value in enum:
+            return value
+        if isinstance(value, str) and value.strip().lower() in folded:
+            return folded[value.strip().lower()]
+        raise ToolArgumentError(f"{path} 应为 {enum} 之一")
+    return check_enum
+
+
+def compile_schema(schema: dict) -> Callable[[Any, str], Any]:
+    """
+    把JSON Schema编译成校验函数
+
+    Returns:
+        callable: check(value, path)，返回修复后的值，不合法时抛出ToolArgumentError
+    """
+    compiler = _COMPILERS.get(schema.get("type"))
+    check = compiler(schema) if compiler else (lambda value, path: value)
+    if "enum" in schema:
+        check = _with_enum(check, list(schema["enum"]))
+    return check
+
+
+def parse_tool_arguments(raw: str) -> dict:
+    """解析模型生成的参数JSON字符串"""
+    try:
+        arguments = json.loads(raw or "{}")
+    except json.JSONDecodeError as e:
+        raise ToolArgumentError(f"参数不是合法的JSON: {e}")
+    if not isinstance(arguments, dict):
+        raise ToolArgumentError("参数应为JSON对象")
+    return arguments
+
+
+class ToolArgumentValidator:
+    """按工具名校验参数，schema在构造时一次性编译"""
+
+    def __init__(self, openai_tools: list):
+        self._checks = {
+            tool["function"]["name"]: compile_schema(tool["function"].get("parameters") or {})
+            for tool in openai_tools
+        }
+
+    def validate(self, tool_name: str, raw_arguments: str) -> dict:
+        """
+        解析并校验工具参数
+
+        Returns:
+            dict: 修复后的参数
+
+        Raises:
+            ToolArgumentError: 工具不存在或参数无法修复
+        """
+        check = self._checks.get(tool_name)
+        if check is None:
+            raise ToolArgumentError(f"未知工具: {tool_name}")
+        return check(parse_tool_arguments(raw_arguments), "arguments")
+
+
+# 相同的工具schema只编译一次
+_validator_cache = {}
+
+
+def get_validator(openai_tools: list) -> ToolArgumentValidator:
+    """获取(必要时编译)与当前工具schema对应的校验器"""
+    key = json.dumps(openai_tools, sort_keys=True, ensure_ascii=False)
+    validator = _validator_cache.get(key)
+    if validator is None:
+        validator = _validator_cache[key] = ToolArgumentValidator(openai_tools)
+    return validator
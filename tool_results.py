@@ -0,0 +1,138 @@
+"""
+工具结果精简
+
+工具原样返回的数据(例如高德的完整 lives 数组)字段多、数值带单位不统一，
+直接作为 role: tool 消息交给模型会浪费输入token、拖慢第二次生成。
+这里按工具声明精简函数，只保留模型回答需要的字段并统一单位，输出紧凑JSON；
+客户端的 tool_result 事件仍然收到完整数据。
+"""
+import json
+import logging
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# 工具名 -> 精简函数，精简函数接收解析后的JSON数据，返回可序列化的对象
+_SHAPERS = {}
+
+
+def result_shaper(tool_name: str):
+    """
+    为工具声明结果精简函数
+
+    Args:
+        tool_name: MCP工具名
+    """
+    def register(func: Callable[[Any], Any]):
+        _SHAPERS[tool_name] = func
+        return func
+    return register
+
+
+def compact_dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _with_unit(value, unit: str):
+    """给数值补上单位，空值返回None"""
+    if value in (None, "", []):
+        return None
+    return f"{value}{unit}"
+
+
+def _wind(direction, power):
+    """风向和风力合成一项，例如 东南风≤3级"""
+    direction = direction if direction not in (None, "", []) else ""
+    power = _with_unit(power, "级") or ""
+    if direction and direction not in ("无风向", "旋转不定") and not direction.endswith("风"):
+        direction += "风"
+    return f"{direction}{power}" or None
+
+
+def _drop_empty(record: dict) -> dict:
+    return {key: value for key, value in record.items() if value not in (None, "", [])}
+
+
+def shape_live(live: dict) -> dict:
+    """精简一条高德实况天气"""
+    return _drop_empty({
+        "city": live.get("city"),
+        "weather": live.get("weather"),
+        "temp": _with_unit(live.get("temperature"), "°C"),
+        "humidity": _with_unit(live.get("humidity"), "%"),
+        "wind": _wind(live.get("winddirection"), live.get("windpower")),
+        "time": live.get("reporttime"),
+        # 过期数据需要让模型知道
+        "stale": live.get("stale") or None,
+    })
+
+
+def shape_forecast(forecast: dict) -> dict:
+    """精简一个城市的高德天气预报"""
+    casts = []
+    for cast in forecast.get("casts") or []:
+        casts.append(_drop_empty({
+            "date": cast.get("date"),
+            "day": " ".join(filter(None, (
+                cast.get("dayweather"),
+                _with_unit(cast.get("daytemp"), "°C"),
+                _wind(cast.get("daywind"), cast.get("daypower")),
+            ))),
+            "night": " ".join(filter(None, (
+                cast.get("nightweather"),
+                _with_unit(cast.get("nighttemp"), "°C"),
+                _wind(cast.get("nightwind"), cast.get("nightpower")),
+            ))),
+        }))
+    return _drop_empty({
+        "city": forecast.get("city"),
+        "time": forecast.get("reporttime"),
+        "casts": casts,
+        "stale": forecast.get("stale") or None,
+    })
+
+
+@result_shaper("weather")
+def shape_weather(data):
+    """weather工具的结构化结果只有lives或forecasts其中之一"""
+    if data.get("forecasts"):
+        return [shape_forecast(item) for item in data["forecasts"]]
+    return [shape_live(item) for item in data.get("lives") or []]
+
+
+@result_shaper("weather_batch")
+def shape_weather_batch(data):
+    """weather_batch工具返回 {城市: 实况或null}"""
+    return {city: shape_live(live) if live else None for city, live in data.items()}
+
+
+def compact_tool_result(tool_name: str, result) -> str:
+    """
+    把工具结果转换成交给模型的精简文本
+
+    没有声明精简函数、结果不是JSON或精简失败时返回完整结果
+
+    Args:
+        tool_name: 工具名
+        result: 工具的结构化结果(structuredContent)或文本结果
+
+    Returns:
+        str: 精简后的文本
+    """
+    data = result
+    if isinstance(result, str):
+        try:
+            data = json.loads(result)
+        except ValueError:
+            # 错误提示等非JSON结果本身就很短
+            return result
+    full = result if isinstance(result, str) else compact_dumps(result)
+
+    shaper = _SHAPERS.get(tool_name)
+    if shaper is None:
+        return full
+    try:
+        return compact_dumps(shaper(data))
+    except Exception as e:
+        logger.warning(f"工具 {tool_name} 的结果无法精简，使用原始结果: {e}")
+        return full
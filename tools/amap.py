@@ -0,0 +1,245 @@
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+from tools.amap_keys import CHINA_TZ, SUCCESS, get_key_pool
+from tools.circuit_breaker import CircuitBreaker
+from tools.latency import HedgeBudget, LatencyTracker
+
+logger = logging.getLogger("server.py")
+
+WEATHER_URL = "https://restapi.amap.com/v3/weather/weatherInfo"
+
+# 高德预报数据每天的发布时刻(北京时间)，可通过环境变量覆盖，例如 "8,11,18"；
+# 空项忽略，设置为空时使用默认值
+FORECAST_PUBLISH_HOURS = tuple(
+    sorted(int(h) for h in os.getenv("FORECAST_PUBLISH_HOURS", "").split(",") if h.strip())
+) or (8, 11, 18)
+# 发布时刻之后再等待多久(秒)才认为新预报已经可用
+FORECAST_PUBLISH_DELAY = float(os.getenv("FORECAST_PUBLISH_DELAY", "600"))
+
+# 复用到高德的长连接，连接池大小不小于批量查询的并发线程数
+AMAP_POOL_SIZE = int(os.getenv("AMAP_POOL_SIZE", os.getenv("WEATHER_BATCH_WORKERS", "4")))
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=AMAP_POOL_SIZE))
+
+# 请求超时：样本足够时取最近p99耗时的AMAP_TIMEOUT_MULTIPLIER倍，并限制在[最小值, 最大值]之间，
+# 样本不足时使用最大值
+AMAP_TIMEOUT_MULTIPLIER = float(os.getenv("AMAP_TIMEOUT_MULTIPLIER", "3"))
+AMAP_MIN_TIMEOUT = float(os.getenv("AMAP_MIN_TIMEOUT", "0.5"))
+AMAP_MAX_TIMEOUT = float(os.getenv("AMAP_MAX_TIMEOUT", "10"))
+# 对冲请求：请求超过最近p95耗时仍未返回时再发送一个相同的请求，使用先返回的结果
+AMAP_HEDGE = os.getenv("AMAP_HEDGE", "1") == "1"
+# 对冲请求最多占总请求数的比例
+AMAP_HEDGE_BUDGET = float(os.getenv("AMAP_HEDGE_BUDGET", "0.1"))
+# 对冲延迟的下限(秒)，避免p95很小时几乎每个请求都被对冲
+AMAP_HEDGE_MIN_DELAY = 0.02
+
+amap_latency = LatencyTracker()
+hedge_budget = HedgeBudget(ratio=AMAP_HEDGE_BUDGET)
+# 对冲时两个请求都在这里执行，落后的请求执行完后结果直接丢弃
+_request_pool = ThreadPoolExecutor(max_workers=AMAP_POOL_SIZE * 2, thread_name_prefix="amap")
+
+# 高德接口的断路器：最近20次请求失败过半时熔断30秒，期间请求直接失败
+amap_breaker = CircuitBreaker(
+    "amap",
+    failure_rate=float(os.getenv("AMAP_BREAKER_FAILURE_RATE", "0.5")),
+    window=20,
+    min_calls=5,
+    open_seconds=float(os.getenv("AMAP_BREAKER_OPEN_SECONDS", "30")),
+)
+
+
+def current_timeout() -> float:
+    '''按最近的耗时分布计算本次请求的超时(秒)'''
+    p99 = amap_latency.quantile(0.99)
+    if p99 is None:
+        return AMAP_MAX_TIMEOUT
+    return min(AMAP_MAX_TIMEOUT, max(AMAP_MIN_TIMEOUT, p99 * AMAP_TIMEOUT_MULTIPLIER))
+
+
+def hedge_delay():
+    '''发送对冲请求之前等待的时间(秒)，样本不足或关闭对冲时返回None'''
+    if not AMAP_HEDGE:
+        return None
+    p95 = amap_latency.quantile(0.95)
+    if p95 is None:
+        return None
+    return max(AMAP_HEDGE_MIN_DELAY, p95)
+
+
+def latency_stats() -> dict:
+    '''最近的耗时分位数和当前超时，供探测结果展示'''
+    return {**amap_latency.snapshot(), "timeout_ms": round(current_timeout() * 1000, 1)}
+
+
+def _timed_get(params, timeout):
+    '''发送一次请求并记录耗时，连接失败等立即出错的请求不计入耗时分布'''
+    started = time.monotonic()
+    try:
+        response = session.get(WEATHER_URL, params=params, timeout=timeout)
+    except requests.Timeout:
+        # 超时按超时时间计入，上游变慢时超时随之放宽
+        amap_latency.record(time.monotonic() - started)
+        metrics.inc("amap_timeouts")
+        raise
+    amap_latency.record(time.monotonic() - started)
+    return response
+
+
+def request_weather(params, allow_hedge=None):
+    '''
+    请求高德天气接口，超时随耗时分布调整，慢请求按预算发送对冲请求
+
+    Args:
+        params: 请求参数
+        allow_hedge: 发送对冲请求前调用，返回False时不发送(例如key没有令牌)
+
+    Returns:
+        requests.Response: 先返回的非5xx响应，都是5xx时返回其中一个
+
+    Raises:
+        requests.RequestException: 所有请求都失败
+    '''
+    timeout = current_timeout()
+    delay = hedge_delay()
+    hedge_budget.deposit()
+    if delay is None or delay >= timeout:
+        return _timed_get(params, timeout)
+
+    primary = _request_pool.submit(_timed_get, params, timeout)
+    done, _ = wait([primary], timeout=delay)
+    if done or not hedge_budget.try_spend() or (allow_hedge is not None and not allow_hedge()):
+        return primary.result()
+
+    metrics.inc("amap_hedges")
+    hedge = _request_pool.submit(_timed_get, params, timeout)
+    pending = {primary, hedge}
+    error = fallback = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except requests.RequestException as e:
+                error = e
+                continue
+            if response.status_code >= 500:
+                fallback = response
+                continue
+            if future is hedge:
+                metrics.inc("amap_hedge_wins")
+            return response
+    if fallback is not None:
+        return fallback
+    raise error
+
+
+def fetch_weather(code, extensions: str = "base", output: str = "JSON"):
+    '''
+    请求高德天气接口
+
+    Args:
+        code: 城市编码 adcode
+        extensions: 气象类型 base/all
+        output: 返回格式 JSON/XML
+
+    Returns:
+        list: base返回实况数据(lives)，all返回预报数据(forecasts)，
+              请求失败、没有可用key或断路器打开时返回None
+    '''
+    pool = get_key_pool()
+    # 只有key引起的失败(配额用尽、QPS超限、key失效)才换一个key重试，每个key最多尝试一次
+    for _ in range(max(1, len(pool.keys))):
+        key = pool.acquire()
+        if key is None:
+            logger.warning(f"没有可用的高德key(未配置、配额用尽或QPS超限)，跳过请求 city={code}")
+            return None
+        if not amap_breaker.allow():
+            pool.refund(key)
+            logger.warning(f"高德断路器已打开，跳过请求 city={code}")
+            return None
+
+        params = {
+            "key": key.value,
+            "city": code,
+            "extensions": extensions,
+            "output": output
+        }
+
+        #调试
+        logger.info(f"正在获取天气数据-------- ({key.name})")
+
+        try:
+            #尝试访问API，对冲请求使用同一个key，也要消耗它的令牌
+            response = request_weather(params, allow_hedge=lambda: pool.try_take(key))
+        except Exception as e:
+            amap_breaker.record_failure()
+            logger.error(f"访问API出现错误:{e}")
+            return None
+
+        # 只有网络错误和5xx算作上游故障，业务错误(status!=1)说明上游可用
+        if response.status_code >= 500:
+            amap_breaker.record_failure()
+            logger.error(f"高德接口返回HTTP {response.status_code}")
+            return None
+        amap_breaker.record_success()
+
+        if response.status_code != 200:
+            logger.error(f"高德接口返回HTTP {response.status_code}")
+            return None
+        try:
+            api_response = response.json()
+        except ValueError as e:
+            logger.error(f"解析API响应出现错误:{e}")
+            return None
+
+        #检查API响应情况
+        if api_response.get("status") == "1":
+            pool.report(key, SUCCESS)
+            return api_response.get("lives" if extensions == "base" else "forecasts")
+        infocode = api_response.get("infocode")
+        key_error = pool.report(key, infocode)
+        logger.error(f"高德接口返回错误 infocode={infocode} info={api_response.get('info')} ({key.name})")
+        if not key_error:
+            return None
+    return None
+
+
+def warm_connection(timeout: float = 5):
+    '''
+    预先建立到高德的连接(TCP和TLS握手)，连接放回连接池供之后的请求复用
+
+    不带key发送HEAD请求，不消耗配额
+
+    Returns:
+        int: HTTP状态码
+    '''
+    response = session.head(WEATHER_URL, timeout=timeout)
+    return response.status_code
+
+
+def forecast_ttl(now: datetime = None) -> float:
+    '''
+    计算预报数据的缓存时间，让缓存恰好在下一次发布之后过期
+
+    Returns:
+        float: 距离下一个发布时刻(加上发布延迟)的秒数
+    '''
+    now = now or datetime.now(CHINA_TZ)
+    delay = timedelta(seconds=FORECAST_PUBLISH_DELAY)
+    for day in (0, 1):
+        date = (now + timedelta(days=day)).date()
+        for hour in FORECAST_PUBLISH_HOURS:
+            available_at = datetime(date.year, date.month, date.day, hour, tzinfo=CHINA_TZ) + delay
+            if available_at > now:
+                return (available_at - now).total_seconds()
+    # 发布时刻配置为空时退化为固定一小时
+    return 3600.0
@@ -0,0 +1,246 @@
+'''
+高德API key池
+
+每个key有自己的令牌桶(QPS)和日配额，请求时选择剩余配额最多且有令牌的key；
+根据响应的infocode识别配额用尽、QPS超限和key失效，把对应的key隔离一段时间，
+其余key继续提供服务，总吞吐量随key的数量增加
+'''
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from metrics import metrics
+
+logger = logging.getLogger("server.py")
+
+# 高德按北京时间每天0点重置日配额
+CHINA_TZ = ZoneInfo("Asia/Shanghai")
+
+# 每个key默认的QPS和日配额，可在AMAP_KEYS中按key单独设置
+AMAP_KEY_QPS = float(os.getenv("AMAP_KEY_QPS", "3"))
+AMAP_KEY_DAILY_QUOTA = int(os.getenv("AMAP_KEY_DAILY_QUOTA", "5000"))
+# 所有key都没有令牌时最多等待多久(秒)，超过后本次请求失败
+AMAP_KEY_WAIT = float(os.getenv("AMAP_KEY_WAIT", "1"))
+# QPS超限时隔离key的时间(秒)
+AMAP_KEY_COOLDOWN = float(os.getenv("AMAP_KEY_COOLDOWN", "5"))
+# key失效(无效、无权限、被回收等)时隔离的时间(秒)
+AMAP_KEY_INVALID_QUARANTINE = float(os.getenv("AMAP_KEY_INVALID_QUARANTINE", "3600"))
+
+SUCCESS = "10000"
+# 日配额用尽，隔离到第二天0点
+QUOTA_INFOCODES = {"10003", "10044", "10045"}
+# 单位时间访问过于频繁或QPS超限，短暂隔离
+RATE_INFOCODES = {"10004", "10014", "10019", "10020", "10021"}
+# key本身不可用：无效、没有服务权限、IP/域名/签名不匹配、被回收等
+INVALID_INFOCODES = {"10001", "10002", "10005", "10006", "10007", "10008", "10009", "10012", "10013"}
+
+
+def _today():
+    return datetime.now(CHINA_TZ).date()
+
+
+def _seconds_until_midnight() -> float:
+    now = datetime.now(CHINA_TZ)
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=CHINA_TZ)
+    return (tomorrow - now).total_seconds()
+
+
+class ApiKey:
+    '''
+    一个高德key的状态，所有字段由KeyPool加锁访问
+
+    Args:
+        value: key
+        name: 日志和指标中使用的名称，不暴露key本身
+        qps: 每秒请求数上限
+        daily_quota: 每天的请求数上限
+    '''
+
+    def __init__(self, value: str, name: str, qps: float = AMAP_KEY_QPS, daily_quota: int = AMAP_KEY_DAILY_QUOTA):
+        self.value = value
+        self.name = name
+        self.qps = qps
+        self.daily_quota = daily_quota
+        self.capacity = max(1.0, qps)
+        self.tokens = self.capacity
+        self.refilled_at = time.monotonic()
+        self.day = _today()
+        self.used_today = 0
+        self.quarantined_until = 0.0
+        self.last_infocode = None
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.qps)
+        self.refilled_at = now
+        today = _today()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.quarantined_until and self.used_today < self.daily_quota
+
+    def wait_time(self) -> float:
+        '''距离下一个令牌的时间(秒)'''
+        return max(0.0, (1 - self.tokens) / self.qps) if self.qps > 0 else float("inf")
+
+
+class KeyPool:
+    '''
+    多个高德key的调度
+
+    Args:
+        keys: ApiKey列表
+        wait: 所有key暂时没有令牌时最多等待的时间(秒)
+    '''
+
+    def __init__(self, keys, wait: float = AMAP_KEY_WAIT):
+        self.keys = list(keys)
+        self.wait = wait
+        self._lock = threading.Lock()
+
+    def _take(self, key: ApiKey):
+        key.tokens -= 1
+        key.used_today += 1
+        metrics.inc(f"amap_key_{key.name}_requests")
+
+    def acquire(self):
+        '''
+        选择一个可用的key并消耗一个令牌
+
+        Returns:
+            ApiKey: 没有可用key或等待令牌超时时返回None
+        '''
+        deadline = time.monotonic() + self.wait
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                candidates = []
+                for key in self.keys:
+                    key.refill(now)
+                    if key.available(now):
+                        candidates.append(key)
+                if not candidates:
+                    return None
+                ready = [key for key in candidates if key.tokens >= 1]
+                if ready:
+                    # 优先使用剩余日配额最多的key，配额消耗保持均匀
+                    key = max(ready, key=lambda key: key.daily_quota - key.used_today)
+                    self._take(key)
+                    return key
+                delay = min(key.wait_time() for key in candidates)
+            if now + delay > deadline:
+                metrics.inc("amap_key_rate_limited")
+                return None
+            time.sleep(delay)
+
+    def try_take(self, key: ApiKey) -> bool:
+        '''不等待地再消耗一个令牌，对冲请求使用同一个key时调用'''
+        now = time.monotonic()
+        with self._lock:
+            key.refill(now)
+            if key.available(now) and key.tokens >= 1:
+                self._take(key)
+                return True
+            return False
+
+    def refund(self, key: ApiKey):
+        '''取得key之后没有真正发出请求时退还令牌和配额'''
+        with self._lock:
+            key.tokens = min(key.capacity, key.tokens + 1)
+            key.used_today = max(0, key.used_today - 1)
+
+    def report(self, key: ApiKey, infocode):
+        '''
+        根据响应的infocode更新key的状态
+
+        Returns:
+            bool: 失败是否由key引起(换一个key重试可能成功)
+        '''
+        infocode = str(infocode) if infocode is not None else None
+        with self._lock:
+            key.last_infocode = infocode
+            if infocode == SUCCESS:
+                return False
+            if infocode in QUOTA_INFOCODES:
+                key.quarantined_until = time.monotonic() + _seconds_until_midnight()
+                reason = "日配额已用尽，隔离到明天"
+            elif infocode in RATE_INFOCODES:
+                key.quarantined_until = time.monotonic() + AMAP_KEY_COOLDOWN
+                reason = f"QPS超限，隔离 {AMAP_KEY_COOLDOWN:.0f} 秒"
+            elif infocode in INVALID_INFOCODES:
+                key.quarantined_until = time.monotonic() + AMAP_KEY_INVALID_QUARANTINE
+                reason = f"key不可用，隔离 {AMAP_KEY_INVALID_QUARANTINE:.0f} 秒"
+            else:
+                reason = None
+        metrics.inc(f"amap_key_{key.name}_errors_{infocode}")
+        if reason is None:
+            return False
+        logger.warning(f"高德key {key.name} 返回 infocode={infocode}，{reason}")
+        return True
+
+    def snapshot(self) -> dict:
+        '''每个key的状态，供探测结果展示'''
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for key in self.keys:
+                key.refill(now)
+                result[key.name] = {
+                    "available": key.available(now),
+                    "tokens": round(key.tokens, 2),
+                    "used_today": key.used_today,
+                    "daily_quota": key.daily_quota,
+                    "quarantined_for": round(max(0.0, key.quarantined_until - now), 1),
+                    "last_infocode": key.last_infocode,
+                }
+        return result
+
+    def usable(self) -> int:
+        '''当前未被隔离且还有日配额的key数量'''
+        now = time.monotonic()
+        with self._lock:
+            for key in self.keys:
+                key.refill(now)
+            return sum(key.available(now) for key in self.keys)
+
+
+def parse_keys(text: str):
+    '''
+    解析key配置，逗号分隔，每项为 key 或 key:qps:日配额
+
+    Returns:
+        list: ApiKey列表
+    '''
+    keys = []
+    for index, item in enumerate(filter(None, (part.strip() for part in text.split(","))), 1):
+        value, _, rest = item.partition(":")
+        qps, _, quota = rest.partition(":")
+        keys.append(ApiKey(
+            value,
+            name=f"key{index}",
+            qps=float(qps) if qps else AMAP_KEY_QPS,
+            daily_quota=int(quota) if quota else AMAP_KEY_DAILY_QUOTA,
+        ))
+    return keys
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool() -> KeyPool:
+    '''
+    获取进程内共享的key池，第一次使用时读取配置
+
+    AMAP_KEYS 配置多个key，未配置时使用 KEY；在server.py加载.env之后才读取
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = KeyPool(parse_keys(os.getenv("AMAP_KEYS") or os.getenv("KEY") or ""))
+            logger.info(f"高德key池: {len(_pool.keys)} 个key")
+        return _pool
@@ -0,0 +1,385 @@
+'''
+可替换的缓存后端
+
+所有后端提供与 TTLCache 相同的接口(get/get_many/set/set_many/get_stale/ttl_remaining)，
+server.py 的天气缓存和 chat_server.py 的工具结果、工具列表缓存都通过 make_cache 创建：
+
+- memory: 进程内LRU(TTLCache)，可叠加SQLite持久化层，默认
+- sqlite: 同一台机器上的多个worker共享一个SQLite(WAL)文件
+- redis:  任何兼容Redis协议(RESP)的服务，多台机器共享，批量读取用MGET，
+          批量写入用流水线一次发送
+
+共享后端的值以JSON保存，只能缓存可以JSON序列化的数据；共享后端的读写是阻塞的
+socket/SQLite调用，异步代码中通过 cache_get / cache_set 放到线程里执行
+'''
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from tools.circuit_breaker import CircuitBreaker
+from tools.persistent_cache import PERSISTENT_CACHE_MAX_STALE, get_store
+from tools.weather_cache import TTLCache, encode_key
+
+logger = logging.getLogger("server.py")
+
+# 缓存后端: memory / sqlite / redis
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+# Redis协议服务地址，例如 redis://:password@127.0.0.1:6379/0
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+# 所有键的前缀，多个服务共用一个Redis时避免冲突
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "mcpserver")
+# Redis连接和读写超时(秒)
+CACHE_REDIS_TIMEOUT = float(os.getenv("CACHE_REDIS_TIMEOUT", "0.5"))
+
+
+class CacheBackend:
+    '''
+    缓存后端基类，子类实现 _read_many / set_many 即可
+
+    条目保存为 (值, 墙上过期时间)，过期后在 max_stale 秒内仍可通过 get_stale 读取
+
+    Args:
+        ttl: 默认过期时间(秒)
+        max_stale: 过期后仍保留的时间(秒)
+    '''
+
+    def __init__(self, ttl: float, max_stale: float = PERSISTENT_CACHE_MAX_STALE):
+        self.ttl = ttl
+        self.max_stale = max_stale
+
+    def _read_many(self, keys) -> dict:
+        '''读取条目，返回 {键: (值, 过期时间)}，不检查是否过期'''
+        raise NotImplementedError
+
+    def set_many(self, items: dict, ttl: float = None):
+        '''批量写入'''
+        raise NotImplementedError
+
+    def set(self, key, value, ttl: float = None):
+        self.set_many({key: value}, ttl)
+
+    def get_many(self, keys) -> dict:
+        '''批量读取，只返回未过期的键'''
+        now = time.time()
+        return {
+            key: value
+            for key, (value, expires_at) in self._read_many(keys).items()
+            if expires_at is None or expires_at > now
+        }
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_stale(self, key, max_stale: float):
+        item = self._read_many([key]).get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        stale_for = 0.0 if expires_at is None else max(0.0, time.time() - expires_at)
+        if stale_for > max_stale:
+            return None
+        return value, stale_for
+
+    def ttl_remaining(self, key):
+        item = self._read_many([key]).get(key)
+        if item is None:
+            return None
+        if item[1] is None:
+            return float("inf")
+        remaining = item[1] - time.time()
+        return remaining if remaining > 0 else None
+
+
+class SQLiteBackend(CacheBackend):
+    '''
+    同一台机器上多个进程共享的SQLite缓存
+
+    Args:
+        store: SQLiteStore实例
+        namespace: 命名空间
+    '''
+
+    def __init__(self, store, namespace: str, ttl: float, **kwargs):
+        super().__init__(ttl, **kwargs)
+        self.store = store
+        self.namespace = namespace
+
+    def _read_many(self, keys) -> dict:
+        keys = list(keys)
+        if not keys:
+            return {}
+        encoded = {encode_key(key): key for key in keys}
+        try:
+            rows = self.store.get_many(self.namespace, list(encoded))
+        except sqlite3.Error as e:
+            # 文件被锁、损坏等情况按未命中处理，不影响请求
+            logger.error(f"读取SQLite缓存失败: {e}")
+            return {}
+        return {encoded[text]: item for text, item in rows.items()}
+
+    def set_many(self, items: dict, ttl: float = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            self.store.set_many(
+                self.namespace,
+                {encode_key(key): value for key, value in items.items()},
+                expires_at,
+            )
+        except sqlite3.Error as e:
+            logger.error(f"写入SQLite缓存失败: {e}")
+
+
+class RedisError(Exception):
+    '''Redis服务返回的错误'''
+
+
+class RedisConnection:
+    '''
+    最小的RESP2客户端，只支持缓存用到的命令，不依赖redis-py
+
+    一个连接同一时间只能执行一组命令，execute 把一组命令一次写出再依次读取
+    回复(流水线)，往返次数与命令数量无关
+
+    Args:
+        url: redis://[:password@]host:port/db
+        timeout: 连接和读写超时(秒)
+    '''
+
+    def __init__(self, url: str, timeout: float = CACHE_REDIS_TIMEOUT):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._file = sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", str(self.db)))
+        if setup:
+            self._send(setup)
+            for args in setup:
+                reply = self._read_reply()
+                if isinstance(reply, RedisError):
+                    # 密码错误或数据库编号无效时不保留这个连接，否则之后的命令都会报不相关的错误
+                    self.close()
+                    raise RedisError(f"{args[0]} 失败: {reply}")
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._file = None
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _send(self, commands):
+        self._sock.sendall(b"".join(self._encode(args) for args in commands))
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Redis连接已断开")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            return RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"无法解析的Redis回复: {line!r}")
+
+    def execute(self, *commands):
+        '''
+        以流水线方式执行一组命令
+
+        Returns:
+            list: 每个命令的回复，命令出错时对应位置是RedisError
+        '''
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._send(commands)
+                    return [self._read_reply() for _ in commands]
+                except (OSError, ConnectionError):
+                    # 连接断开时重连一次，仍然失败再抛出
+                    self.close()
+                    if attempt:
+                        raise
+
+
+class RedisBackend(CacheBackend):
+    '''
+    兼容Redis协议的共享缓存
+
+    值保存为 {"v": 值, "e": 过期时间} 的JSON，Redis键的存活时间为 ttl+max_stale，
+    过期数据在这段时间内仍可用于降级
+
+    Args:
+        connection: RedisConnection实例
+        namespace: 命名空间，拼接在键前缀之后
+    '''
+
+    def __init__(self, connection: RedisConnection, namespace: str, ttl: float, **kwargs):
+        super().__init__(ttl, **kwargs)
+        self.connection = connection
+        self.prefix = f"{CACHE_KEY_PREFIX}:{namespace}:"
+
+    def _execute(self, *commands):
+        '''执行命令，Redis不可用时返回None，由断路器避免每次请求都等待超时'''
+        if not redis_breaker.allow():
+            return None
+        try:
+            replies = self.connection.execute(*commands)
+        except (OSError, ConnectionError, RedisError) as e:
+            redis_breaker.record_failure()
+            logger.error(f"访问Redis缓存失败: {e}")
+            return None
+        redis_breaker.record_success()
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                logger.error(f"Redis缓存命令出错: {reply}")
+        return replies
+
+    def _redis_key(self, key) -> str:
+        return self.prefix + encode_key(key)
+
+    def _read_many(self, keys) -> dict:
+        keys = list(keys)
+        if not keys:
+            return {}
+        # 一次MGET读取所有键
+        replies = self._execute(("MGET", *[self._redis_key(key) for key in keys]))
+        if replies is None or isinstance(replies[0], RedisError):
+            return {}
+        values = replies[0]
+        result = {}
+        for key, raw in zip(keys, values):
+            if raw is None:
+                continue
+            item = json.loads(raw)
+            result[key] = (item["v"], item["e"])
+        return result
+
+    def set_many(self, items: dict, ttl: float = None):
+        if not items:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl
+        keep = max(1, int(ttl + self.max_stale))
+        commands = [
+            (
+                "SET",
+                self._redis_key(key),
+                json.dumps({"v": value, "e": expires_at}, ensure_ascii=False, separators=(",", ":")),
+                "EX",
+                str(keep),
+            )
+            for key, value in items.items()
+        ]
+        # 所有SET在一次往返中发送
+        self._execute(*commands)
+
+
+# Redis不可用时缓存直接未命中，不让每个请求都等待连接超时
+redis_breaker = CircuitBreaker("redis_cache", open_seconds=10)
+
+_redis_connection = None
+_redis_lock = threading.Lock()
+
+
+def _get_redis_connection():
+    global _redis_connection
+    with _redis_lock:
+        if _redis_connection is None:
+            _redis_connection = RedisConnection(CACHE_REDIS_URL)
+        return _redis_connection
+
+
+def make_cache(namespace: str, ttl: float, maxsize: int = 1024, backend: str = None, persistent: bool = False):
+    '''
+    按配置创建缓存
+
+    Args:
+        namespace: 命名空间，共享后端中用来区分不同用途的数据
+        ttl: 默认过期时间(秒)
+        maxsize: 进程内缓存的最大条目数，只对memory后端有效
+        backend: memory/sqlite/redis，默认读取CACHE_BACKEND
+        persistent: memory后端是否叠加SQLite持久化层(需要调用warm预热)
+
+    Returns:
+        TTLCache或CacheBackend，接口一致
+    '''
+    backend = backend or CACHE_BACKEND
+    if backend == "redis":
+        return RedisBackend(_get_redis_connection(), namespace, ttl)
+    if backend == "sqlite":
+        store = get_store()
+        if store is not None:
+            return SQLiteBackend(store, namespace, ttl)
+        logger.warning("未配置持久化缓存路径，退回进程内缓存")
+    elif backend != "memory":
+        logger.warning(f"未知的缓存后端 {backend}，使用进程内缓存")
+    return TTLCache(ttl=ttl, maxsize=maxsize, store=get_store() if persistent else None, namespace=namespace)
+
+
+async def cache_get(cache, key):
+    '''
+    在异步代码中读取缓存
+
+    共享后端的网络/磁盘I/O放到线程里执行，不阻塞事件循环上的其他请求；
+    进程内缓存直接读取
+    '''
+    if isinstance(cache, CacheBackend):
+        return await asyncio.to_thread(cache.get, key)
+    return cache.get(key)
+
+
+async def cache_set(cache, key, value, ttl: float = None):
+    '''在异步代码中写入缓存，规则同 cache_get'''
+    args = (key, value) if ttl is None else (key, value, ttl)
+    if isinstance(cache, CacheBackend):
+        await asyncio.to_thread(cache.set, *args)
+    else:
+        cache.set(*args)
@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("server.py")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    '''
+    按失败率熔断的断路器
+
+    最近window次调用中失败比例超过failure_rate(且调用次数不少于min_calls)时打开，
+    打开期间直接拒绝请求；open_seconds之后进入半开状态，只放行一个探测请求，
+    探测成功则关闭断路器，失败则重新打开
+
+    Args:
+        name: 名称，用于日志
+        failure_rate: 触发熔断的失败率
+        window: 统计最近多少次调用
+        min_calls: 至少多少次调用后才开始判断失败率
+        open_seconds: 打开状态持续时间(秒)
+    '''
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=5, open_seconds=30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._results = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        '''判断本次请求是否放行，打开状态下立即返回False'''
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._state = HALF_OPEN
+                logger.info(f"[{self.name}] 断路器进入半开状态，放行探测请求")
+            # 半开状态同一时间只放行一个探测请求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._results.clear()
+                logger.info(f"[{self.name}] 探测成功，断路器关闭")
+            self._probing = False
+            self._results.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            self._probing = False
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            self._results.append(False)
+            failures = self._results.count(False)
+            if (
+                self._state == CLOSED
+                and len(self._results) >= self.min_calls
+                and failures / len(self._results) >= self.failure_rate
+            ):
+                self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        logger.warning(f"[{self.name}] 上游失败率过高，断路器打开 {self.open_seconds} 秒")
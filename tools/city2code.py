@@ -1,5 +1,53 @@
-import pandas as pd 
 import os 
+import re
+from functools import lru_cache
+
+from tools.persistent_cache import get_store
+
+# 未找到城市时默认返回深圳市
+DEFAULT_ADCODE = 440300
+
+
+@lru_cache(maxsize=1)
+def load_adcode_index():
+    '''
+    读取高德城市编码表并构建索引，整个进程只读取一次Excel
+
+    Returns:
+        dict: 城市名/adcode字符串 -> adcode，重名时保留表中第一条
+    '''
+    execel_path = os.path.join(os.getcwd(), "AMap_adcode_citycode.xlsx")
+
+    # 持久化缓存中有同一份Excel构建的索引时直接使用，不必再读Excel
+    store = get_store()
+    store_key = execel_path
+    version = os.path.getmtime(execel_path) if os.path.exists(execel_path) else None
+    if store is not None:
+        cached = store.get("adcode", store_key)
+        if cached is not None and cached[0].get("version") == version:
+            return cached[0]["index"]
+
+    # pandas导入耗时较长，只在第一次查询城市时导入
+    import pandas as pd
+
+    data = pd.read_excel(execel_path,sheet_name="Sheet1")
+    print(f"execel_path : {execel_path}")
+    index = {}
+    for name, code in zip(data["name"], data["adcode"]):
+        index.setdefault(name, int(code))
+        # 同时收录adcode本身，传入编码时可以直接命中
+        index.setdefault(str(code), int(code))
+
+    if store is not None:
+        store.set("adcode", store_key, {"version": version, "index": index})
+    return index
+
+
+def _lookup(index, city):
+    '''在索引中查找城市，已经是adcode的直接返回'''
+    return index.get(str(city).strip())
+
+
 def adcode(city:str):
     '''
     根据用户的城市，返回对应的高德地图支持的城市编码
@@ -10,21 +58,110 @@ def adcode(city:str):
     Returns:
         result:对应的城市编码
     '''
-    execel_path = os.path.join(os.getcwd(), "AMap_adcode_citycode.xlsx")
     try:
-        data = pd.read_excel(execel_path,sheet_name="Sheet1")
-        print(f"execel_path : {execel_path}")
         #精确匹配：
-        result = data[data["name"]==city]
-        if not result.empty:
-            return result.iloc[0]['adcode']
+        code = _lookup(load_adcode_index(), city)
+        if code is not None:
+            return code
         # suffixes = ["市", "省", "县", "区", "自治区", "特别行政区"]
 
         else:
             print("未找到对应的城市，默认返回深圳市天气")
-            return 440300
+            return DEFAULT_ADCODE
         
     except Exception as e:
         print(f"读取数据错误:{e}")  
         print("默认返回深圳市天气")
-        return 440300
+        return DEFAULT_ADCODE
+
+
+def resolve_cities(cities):
+    '''
+    批量解析城市编码，只访问一次索引
+
+    Args:
+        cities: 城市名列表
+
+    Returns:
+        dict: 城市名 -> adcode，未找到的城市值为None
+    '''
+    try:
+        index = load_adcode_index()
+    except Exception as e:
+        print(f"读取数据错误:{e}")
+        return {city: None for city in cities}
+    return {city: _lookup(index, city) for city in cities}
+
+
+# 城市名常见后缀，用户提问时经常省略，例如 "深圳" -> "深圳市"
+CITY_SUFFIXES = ("特别行政区", "自治区", "自治州", "市", "省", "区", "县")
+
+
+@lru_cache(maxsize=1)
+def _city_matcher():
+    '''
+    构建城市名匹配器：别名 -> 标准城市名，以及按长度优先的正则
+
+    Returns:
+        tuple: (别名字典, 编译好的正则)
+    '''
+    aliases = {}
+    for name in load_adcode_index():
+        if name.isdigit() or name == "中国":
+            continue
+        aliases.setdefault(name, name)
+        for suffix in CITY_SUFFIXES:
+            short = name[: -len(suffix)]
+            if name.endswith(suffix) and len(short) >= 2:
+                aliases.setdefault(short, name)
+                break
+    # 长的名字优先匹配，避免 "深圳市" 只匹配到 "深圳"
+    names = sorted(aliases, key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(name) for name in names))
+    return aliases, pattern
+
+
+def warm_index():
+    '''
+    启动预热：加载城市编码表并构建城市名匹配器
+
+    Returns:
+        int: 可识别的城市名数量
+    '''
+    aliases, _ = _city_matcher()
+    return len(aliases)
+
+
+def extract_cities(text:str):
+    '''
+    从一段文本中找出提到的城市
+
+    Args:
+        text: 用户消息
+
+    Returns:
+        list: 按出现顺序排列、去重后的标准城市名
+    '''
+    try:
+        aliases, pattern = _city_matcher()
+    except Exception as e:
+        print(f"读取数据错误:{e}")
+        return []
+    found = [aliases[match.group(0)] for match in pattern.finditer(text)]
+    return list(dict.fromkeys(found))
+
+
+def canonical_city(city):
+    '''
+    把城市名、简称或adcode统一转换为adcode，用于比较两个城市参数是否指向同一城市
+
+    Returns:
+        int: adcode，无法识别时返回None
+    '''
+    try:
+        aliases, _ = _city_matcher()
+        index = load_adcode_index()
+    except Exception:
+        return None
+    city = str(city).strip()
+    return index.get(aliases.get(city, city))
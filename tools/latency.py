@@ -0,0 +1,82 @@
+import math
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    '''
+    记录最近若干次请求的耗时，计算分位数
+
+    Args:
+        window: 保留最近多少次请求的耗时
+        min_samples: 样本少于这个数量时分位数返回None，调用方使用默认值
+    '''
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float):
+        '''
+        计算分位数(最近秩法)
+
+        Args:
+            q: 0到1之间，例如0.99
+
+        Returns:
+            float: 耗时(秒)，样本不足时返回None
+        '''
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        '''p50/p95/p99(毫秒)，样本不足时为None'''
+        result = {}
+        for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            value = self.quantile(q)
+            result[name] = None if value is None else round(value * 1000, 1)
+        with self._lock:
+            result["samples"] = len(self._samples)
+        return result
+
+
+class HedgeBudget:
+    '''
+    对冲请求的预算，限制对冲请求占总请求数的比例
+
+    每个请求存入ratio个令牌，每次对冲消耗一个令牌，令牌最多积累burst个，
+    上游整体变慢时对冲不会让请求量翻倍
+
+    Args:
+        ratio: 对冲请求最多占总请求数的比例，例如0.1
+        burst: 最多积累的令牌数
+    '''
+
+    def __init__(self, ratio: float = 0.1, burst: float = 10):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        '''每发起一个请求调用一次'''
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        '''预算足够时消耗一个令牌并返回True'''
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("server.py")
+
+# 持久化缓存文件路径，设为空字符串关闭持久化
+PERSISTENT_CACHE_PATH = os.getenv(
+    "PERSISTENT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "weather_cache.sqlite3"),
+)
+# 条目过期多久(秒)之后才从磁盘删除，与WEATHER_STALE_MAX_AGE一致，过期数据仍可用于降级
+PERSISTENT_CACHE_MAX_STALE = float(
+    os.getenv("PERSISTENT_CACHE_MAX_STALE", os.getenv("WEATHER_STALE_MAX_AGE", "21600"))
+)
+# 每写入多少次清理一次过期太久的条目
+COMPACT_EVERY = 500
+
+
+class SQLiteStore:
+    '''
+    基于SQLite(WAL模式)的持久化键值存储，作为内存缓存的下一层
+
+    值以JSON保存，过期时间使用墙上时间(time.time)，进程重启后仍然有效；
+    expires_at 为NULL表示永不过期。不同用途的数据用namespace区分
+
+    Args:
+        path: 数据库文件路径
+        max_stale: 条目过期多久(秒)之后在压缩时删除
+    '''
+
+    def __init__(self, path: str, max_stale: float = 0.0):
+        self.path = path
+        self.max_stale = max_stale
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下NORMAL足够安全，掉电最多丢失最后几次写入
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+
+    def get(self, namespace: str, key: str):
+        '''
+        读取一个条目(不检查是否过期)
+
+        Returns:
+            tuple: (值, 过期时间)，不存在返回None
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def get_many(self, namespace: str, keys: list) -> dict:
+        '''
+        批量读取(不检查是否过期)，一条SQL读取所有键
+
+        Returns:
+            dict: {键: (值, 过期时间)}，只包含存在的键
+        '''
+        result = {}
+        # SQLite单条语句的参数个数有限制，按批读取
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, value, expires_at FROM cache WHERE namespace = ? AND key IN ({placeholders})",
+                    (namespace, *batch),
+                ).fetchall()
+            for key, value, expires_at in rows:
+                result[key] = (json.loads(value), expires_at)
+        return result
+
+    def set(self, namespace: str, key: str, value, expires_at: float = None):
+        '''写入一个条目，expires_at为墙上时间，None表示永不过期'''
+        self.set_many(namespace, {key: value}, expires_at)
+
+    def set_many(self, namespace: str, items: dict, expires_at: float = None):
+        '''在一个事务中写入多个条目'''
+        rows = [
+            (namespace, key, json.dumps(value, ensure_ascii=False, separators=(",", ":")), expires_at)
+            for key, value in items.items()
+        ]
+        with self._lock:
+            # 连接处于自动提交模式，显式开启事务让多条写入只提交一次
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            before = self._writes
+            self._writes += len(rows)
+            compact = before // COMPACT_EVERY != self._writes // COMPACT_EVERY
+        if compact:
+            self.compact()
+
+    def load(self, namespace: str):
+        '''
+        读取namespace下所有还能使用的条目，过期超过max_stale的不返回
+
+        Returns:
+            list: [(键, 值, 过期时间)]
+        '''
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, expires_at FROM cache"
+                " WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, time.time() - self.max_stale),
+            ).fetchall()
+        return [(key, json.loads(value), expires_at) for key, value, expires_at in rows]
+
+    def compact(self):
+        '''删除过期太久的条目，并把WAL合并回主库文件'''
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time() - self.max_stale,),
+            ).rowcount
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if deleted:
+            logger.info(f"持久化缓存清理了 {deleted} 个过期条目")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    '''获取进程内共享的持久化存储，未配置路径或打开失败时返回None'''
+    global _store
+    if not PERSISTENT_CACHE_PATH:
+        return None
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = SQLiteStore(PERSISTENT_CACHE_PATH, max_stale=PERSISTENT_CACHE_MAX_STALE)
+                _store.compact()
+            except sqlite3.Error as e:
+                logger.error(f"打开持久化缓存失败，仅使用内存缓存: {e}")
+                return None
+        return _store
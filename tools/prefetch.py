@@ -0,0 +1,139 @@
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger("server.py")
+
+
+class DecayingCounter:
+    '''
+    按指数衰减的请求计数器，用于找出最近访问最多的键
+
+    每个键的分数每经过half_life秒减半，旧的热点会自然冷却；分数低于min_score的键
+    视为已经冷却，不再返回并被丢弃，没有流量时不会继续刷新；
+    键数量超过max_keys时丢弃分数最低的一半，内存占用有上限
+
+    Args:
+        half_life: 分数减半的时间(秒)
+        max_keys: 最多跟踪的键数量
+        min_score: 低于该分数的键被丢弃，默认0.5即最近一个半衰期内至少访问过一次
+    '''
+
+    def __init__(self, half_life: float = 1800.0, max_keys: int = 4096, min_score: float = 0.5):
+        self.half_life = half_life
+        self.max_keys = max_keys
+        self.min_score = min_score
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, score, updated_at, now):
+        return score * 0.5 ** ((now - updated_at) / self.half_life)
+
+    def hit(self, key, weight: float = 1.0):
+        now = time.monotonic()
+        with self._lock:
+            score, updated_at = self._scores.get(key, (0.0, now))
+            self._scores[key] = (self._decayed(score, updated_at, now) + weight, now)
+            if len(self._scores) > self.max_keys:
+                self._prune(now)
+
+    def _prune(self, now):
+        ranked = sorted(
+            self._scores.items(),
+            key=lambda item: self._decayed(*item[1], now),
+            reverse=True,
+        )
+        self._scores = {
+            key: item
+            for key, item in ranked[: self.max_keys // 2]
+            if self._decayed(*item, now) >= self.min_score
+        }
+
+    def score(self, key) -> float:
+        now = time.monotonic()
+        with self._lock:
+            item = self._scores.get(key)
+            return self._decayed(*item, now) if item else 0.0
+
+    def top(self, n: int):
+        '''返回当前分数最高的n个键，按分数从高到低排列，已经冷却的键不返回并被丢弃'''
+        now = time.monotonic()
+        with self._lock:
+            scored = {key: self._decayed(*item, now) for key, item in self._scores.items()}
+            for key, score in scored.items():
+                if score < self.min_score:
+                    del self._scores[key]
+        warm = [(key, score) for key, score in scored.items() if score >= self.min_score]
+        return [key for key, _ in heapq.nlargest(n, warm, key=lambda item: item[1])]
+
+
+class Prefetcher:
+    '''
+    后台预取线程：定期检查访问最多的键，在缓存过期前主动刷新
+
+    Args:
+        name: 线程名，用于日志
+        cache: TTLCache实例
+        counter: 提供top(n)的请求计数器
+        refresh: 刷新函数，接收缓存键，负责请求上游并写回缓存
+        top_n: 每轮最多检查的键数量
+        lead: 剩余有效期小于该值(秒)时刷新
+        interval: 检查间隔(秒)
+        budget: 每轮最多向上游发起的刷新次数，为None时不限制
+    '''
+
+    def __init__(self, name, cache, counter, refresh, top_n=10, lead=120.0, interval=60.0, budget=None):
+        self.name = name
+        self.cache = cache
+        self.counter = counter
+        self.refresh = refresh
+        self.top_n = top_n
+        self.lead = lead
+        self.interval = interval
+        self.budget = budget
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        '''首次调用时启动后台线程，之后的调用直接返回'''
+        if self._thread is not None or self.top_n <= 0:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"prefetch-{self.name}", daemon=True
+                )
+                self._thread.start()
+                logger.info(f"[{self.name}] 预取线程已启动，top_n={self.top_n}")
+
+    def stop(self):
+        self._stop.set()
+
+    def due_keys(self):
+        '''本轮需要刷新的键，越热的键越先刷新，超出预算的留到下一轮；已经冷却的键不刷新'''
+        keys = []
+        for key in self.counter.top(self.top_n):
+            remaining = self.cache.ttl_remaining(key)
+            if remaining is None or remaining < self.lead:
+                keys.append(key)
+                if self.budget is not None and len(keys) >= self.budget:
+                    break
+        return keys
+
+    def run_once(self):
+        '''执行一轮预取，返回刷新的键数量'''
+        keys = self.due_keys()
+        for key in keys:
+            try:
+                self.refresh(key)
+            except Exception as e:
+                logger.error(f"[{self.name}] 预取 {key} 失败: {e}")
+        if keys:
+            logger.info(f"[{self.name}] 预取刷新 {len(keys)} 个条目")
+        return len(keys)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
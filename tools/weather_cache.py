@@ -0,0 +1,141 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("server.py")
+
+
+def encode_key(key) -> str:
+    '''缓存键编码为字符串，供持久化和共享缓存使用'''
+    return json.dumps(key, ensure_ascii=False)
+
+
+def decode_key(text: str):
+    # JSON没有元组，(code, output) 这样的键读回来是列表
+    key = json.loads(text)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class TTLCache:
+    '''
+    线程安全的TTL缓存，超过容量时淘汰最久未使用的条目
+
+    过期条目不会立即删除，上游不可用时可以通过get_stale读取旧数据。
+    配置了持久化存储时写入会同步写到存储中，进程启动时用warm()把
+    存储中的条目读回内存，重启后不必重新请求上游
+
+    Args:
+        ttl: 默认过期时间(秒)
+        maxsize: 最大条目数
+        store: 持久化存储(SQLiteStore)，为None时只在内存中缓存
+        namespace: 在持久化存储中使用的命名空间
+    '''
+
+    def __init__(self, ttl: float, maxsize: int = 1024, store=None, namespace: str = ""):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.store = store
+        self.namespace = namespace
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''读取未过期的值，不存在或已过期返回None'''
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def get_stale(self, key, max_stale: float):
+        '''
+        读取可能已经过期的值
+
+        Args:
+            key: 缓存键
+            max_stale: 允许过期的最长时间(秒)
+
+        Returns:
+            tuple: (值, 已过期秒数)，未过期时过期秒数为0；不存在或过期太久返回None
+        '''
+        with self._lock:
+            item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        stale_for = max(0.0, time.monotonic() - expires_at)
+        if stale_for > max_stale:
+            return None
+        return value, stale_for
+
+    def ttl_remaining(self, key):
+        '''返回条目剩余的有效时间(秒)，不存在或已过期返回None'''
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            remaining = item[1] - time.monotonic()
+            return remaining if remaining > 0 else None
+
+    def get_many(self, keys):
+        '''批量读取，只返回命中的键'''
+        result = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set_many(self, items: dict, ttl: float = None):
+        '''批量写入，与共享缓存后端接口一致'''
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def set(self, key, value, ttl: float = None):
+        '''写入缓存，ttl为空时使用默认过期时间'''
+        ttl = self.ttl if ttl is None else ttl
+        self._set_local(key, value, time.monotonic() + ttl)
+        if self.store is not None:
+            try:
+                self.store.set(self.namespace, encode_key(key), value, time.time() + ttl)
+            except Exception as e:
+                logger.error(f"写入持久化缓存失败: {e}")
+
+    def _set_local(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def warm(self) -> int:
+        '''
+        从持久化存储加载条目到内存，已过期但仍可作为过期数据使用的条目也会加载
+
+        Returns:
+            int: 加载的条目数
+        '''
+        if self.store is None:
+            return 0
+        try:
+            rows = self.store.load(self.namespace)
+        except Exception as e:
+            logger.error(f"读取持久化缓存失败: {e}")
+            return 0
+        # 存储中是墙上时间，换算成单调时钟
+        offset = time.monotonic() - time.time()
+        # 按过期时间从早到晚写入，容量不够时保留最新的条目
+        rows.sort(key=lambda row: float("inf") if row[2] is None else row[2])
+        for key, value, expires_at in rows:
+            expires_at = float("inf") if expires_at is None else expires_at + offset
+            self._set_local(decode_key(key), value, expires_at)
+        return len(rows)
+
+    def __len__(self):
+        return len(self._data)
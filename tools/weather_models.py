@@ -0,0 +1,73 @@
+'''
+天气工具的结构化输出
+
+FastMCP 根据工具的返回类型生成 outputSchema，并把返回的模型放进 structuredContent，
+客户端可以直接读取字段，不必再解析文本
+'''
+from typing import Annotated
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict
+
+
+def _amap_str(value):
+    '''高德缺失的字段会返回空数组，统一转成空字符串'''
+    if value is None or value == []:
+        return ""
+    return str(value)
+
+
+AmapStr = Annotated[str, BeforeValidator(_amap_str)]
+
+
+class LiveWeather(BaseModel):
+    '''一个城市的实况天气，字段与高德 lives 一致'''
+    model_config = ConfigDict(extra="ignore")
+
+    province: AmapStr = ""
+    city: AmapStr = ""
+    adcode: AmapStr = ""
+    weather: AmapStr = ""
+    temperature: AmapStr = ""
+    winddirection: AmapStr = ""
+    windpower: AmapStr = ""
+    humidity: AmapStr = ""
+    reporttime: AmapStr = ""
+    # 高德不可用时返回的过期缓存数据
+    stale: bool = False
+
+
+class ForecastCast(BaseModel):
+    '''某一天的预报，字段与高德 casts 一致'''
+    model_config = ConfigDict(extra="ignore")
+
+    date: AmapStr = ""
+    week: AmapStr = ""
+    dayweather: AmapStr = ""
+    nightweather: AmapStr = ""
+    daytemp: AmapStr = ""
+    nighttemp: AmapStr = ""
+    daywind: AmapStr = ""
+    nightwind: AmapStr = ""
+    daypower: AmapStr = ""
+    nightpower: AmapStr = ""
+
+
+class Forecast(BaseModel):
+    '''一个城市的天气预报，字段与高德 forecasts 一致'''
+    model_config = ConfigDict(extra="ignore")
+
+    province: AmapStr = ""
+    city: AmapStr = ""
+    adcode: AmapStr = ""
+    reporttime: AmapStr = ""
+    casts: list[ForecastCast] = []
+    stale: bool = False
+
+
+class WeatherResult(BaseModel):
+    '''weather工具的返回值，base只有lives，all只有forecasts'''
+    query: str
+    adcode: int
+    extensions: str
+    lives: list[LiveWeather] = []
+    forecasts: list[Forecast] = []
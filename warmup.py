@@ -0,0 +1,97 @@
+"""
+启动预热
+
+重启后的第一批请求要承担TLS握手、MCP会话初始化、读取城市编码表、生成工具schema等开销。
+两个服务器启动后在后台执行预热步骤，全部结束之前 /health 报告未就绪(HTTP 503)，
+负载均衡只把流量转给已经预热好的实例；单个步骤失败只记录错误，不阻止就绪。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 是否在启动时预热，设为0时启动后立即就绪
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# 单个异步预热步骤最长等待时间(秒)
+WARMUP_STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", "15"))
+# 启动时预先查询实时天气的城市，逗号分隔，例如 "北京市,上海市,广州市,深圳市"
+WARMUP_CITIES = [city.strip() for city in os.getenv("WARMUP_CITIES", "").split(",") if city.strip()]
+
+
+class Readiness:
+    """
+    记录预热进度和就绪状态
+
+    存活(进程能响应请求)与就绪(预热完成、可以接收流量)分开报告
+    """
+
+    def __init__(self, enabled: bool = WARMUP_ENABLED):
+        self._lock = threading.Lock()
+        self._steps = {}
+        self._started_at = time.monotonic()
+        self._warmup_seconds = None
+        self._ready = not enabled
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self._ready
+
+    def mark_ready(self):
+        with self._lock:
+            if self._ready:
+                return
+            self._ready = True
+            self._warmup_seconds = round(time.monotonic() - self._started_at, 3)
+            failed = [name for name, step in self._steps.items() if not step["ok"]]
+        if failed:
+            logger.warning(f"预热完成，以下步骤失败: {', '.join(failed)}")
+        else:
+            logger.info(f"预热完成，用时 {self._warmup_seconds} 秒")
+
+    def _record(self, name: str, started: float, error: Exception = None, detail=None):
+        step = {"ok": error is None, "ms": round((time.monotonic() - started) * 1000, 1)}
+        if error is not None:
+            step["error"] = str(error) or type(error).__name__
+            logger.warning(f"预热步骤 {name} 失败: {step['error']}")
+        elif detail is not None:
+            step["detail"] = detail
+        with self._lock:
+            self._steps[name] = step
+
+    def run_step(self, name: str, func):
+        """在当前线程执行一个预热步骤，func的返回值作为步骤说明"""
+        started = time.monotonic()
+        try:
+            detail = func()
+        except Exception as e:
+            self._record(name, started, error=e)
+        else:
+            self._record(name, started, detail=detail)
+
+    async def run_step_async(self, name: str, func, timeout: float = WARMUP_STEP_TIMEOUT):
+        """执行一个异步预热步骤，超过timeout秒视为失败"""
+        started = time.monotonic()
+        try:
+            detail = await asyncio.wait_for(func(), timeout)
+        except asyncio.TimeoutError:
+            self._record(name, started, error=TimeoutError(f"超过 {timeout} 秒未完成"))
+        except Exception as e:
+            self._record(name, started, error=e)
+        else:
+            self._record(name, started, detail=detail)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self._ready,
+                "warmup_seconds": self._warmup_seconds,
+                "steps": {name: dict(step) for name, step in self._steps.items()},
+            }
+
+
+# 进程内的就绪状态，chat_server 和 server.py 各自使用
+readiness = Readiness()